@@ -1,13 +1,30 @@
-from scipy import stats
 import numpy as np
 import pandas as pd
 import xarray as xr
-import datetime
+import io
 import os
+import re
+import glob
+import json
 import math
+import pickle
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 #=============================================== T file functions =====================================================================================================
-def t_reader(filename):
+# Columns of the whitespace delimited .T file. Each profile is 6 header lines followed by one line per depth cell
+# (line 6 of the first profile holds the number of cells). Header values used:
+#   line 0: year, month, day, hour, minute, second ... ADP heading (column 11)
+#   line 1: three beam depths (columns 8-10)
+#   line 2: distance made good (column 4)
+#   line 3: latitude, longitude, sampling interval in seconds (columns 0-2)
+T_COLUMNS = ["Bin_depth", "V", "Water_dir", "V_x", "V_y", "V_z", "6", "7", "8", "9", "10", "11", "Flag"]
+T_VELOCITIES = ["V", "V_x", "V_y", "V_z"]   # cm/s in the file, m/s in the output
+T_READER_COLUMNS = ['Profile', 'Date_time', 'Latitude', 'Longitude', 'Delta_DMG', 'Avg_depth', 'Bin_depth',
+                    'V', 'ADP_heading', 'Water_dir', 'V_x', 'V_y', 'V_z', 'Flag']
+
+def t_reader(filename, flag_max=100):
 
     """
     Rearanges .T files into a more user friendly format with labelled columns and depth-binned velocities. Creates the basic dataframe file used
@@ -16,62 +33,147 @@ def t_reader(filename):
     REQUIREMENTS AND CONSIDERATIONS
     - .T file converted into space deliniated .csv files
     - ADP heading is based on XYZ coordinate system, if another coordinate system (ENU or BEAM) is used you may have to alter some of the code
+    - Cells with a flag over flag_max (100 by default) have their velocities, heading and water direction set to nan (the first cell of each profile is never flagged)
+    - The file is read once and every profile has the same number of lines, so the whole file is reshaped to
+      (profile x line) arrays and the result is built in one step instead of one profile at a time
 
     INPUTS
     - filename of .T file converted into read_csv
+    - flag_max: largest flag value of a good depth cell
 
     OUTPUTS
     - t_reader dataframe that can be saved as .csv
     """
-    dfT = dfT = pd.read_csv(str(filename), delimiter='\s+', names = ["Bin_depth", "V", "Water_dir", "V_x", "V_y", "V_z", "6", "7", "8", "9", "10", "11", "Flag"])
-
-    line_end = int(dfT.iloc[5,0])
-    line_end = line_end+6
-
-    start_time = str(str(int(dfT.iloc[0,0])) + '-' + str(int(dfT.iloc[0,1])) + '-' + str(int(dfT.iloc[0,2]))
-                + ' ' + str(int(dfT.iloc[0,3])) + ':' + str(int(dfT.iloc[0,4])) + ':' + str(int(dfT.iloc[0,5])))
-    samp_int = str(dfT.iloc[3,2] + 'S')
-    times = pd.date_range(str(start_time), periods=int((len(dfT)/line_end)), freq=samp_int)
-    dfT["V"] = pd.to_numeric(dfT["V"], errors = "coerce", downcast="float")
-    dfT['V'] = dfT['V']/100
-    dfT["V_x"] = pd.to_numeric(dfT["V_x"], errors = "coerce", downcast="float")
-    dfT['V_x'] = dfT['V_x']/100
-    dfT["V_y"] = pd.to_numeric(dfT["V_y"], errors = "coerce", downcast="float")
-    dfT['V_y'] = dfT['V_y']/100
-    dfT["V_z"] = pd.to_numeric(dfT["V_z"], errors = "coerce", downcast="float")
-    dfT['V_z'] = dfT['V_z']/100
-
-    df1 = dfT.iloc[6:line_end,:]
-    df1.insert(2,'ADP_heading',dfT.iloc[0,11])
-    df1.insert(0,'Avg_depth', np.mean(dfT.iloc[1,8:11]))
-    df1.insert(0,'Delta_DMG',dfT.iloc[2,4])
-    df1.insert(0,'Longitude',dfT.iloc[3,1])
-    df1.insert(0,'Latitude',dfT.iloc[3,0])
-    df1.insert(0,'Date_time',times[0])
-    df1.insert(0,'Profile', 1)
-    for i in range(1, len(df1)):
-        if df1.iloc[i,19]>100:
-            df1.iloc[i, 7:14] = 'nan'
-    for x in range(1, int((len(dfT)/line_end))):
-        df2 = dfT.iloc[(6+(line_end*x)):(line_end*(x+1)),:]
-        df2.insert(2,'ADP_heading',dfT.iloc[((line_end*x)),11])
-        df2.insert(0,'Avg_depth',np.mean(dfT.iloc[1+(line_end*x),8:11]))
-        df2.insert(0,'Delta_DMG',((dfT.iloc[(2+(line_end*x)),4]) - (dfT.iloc[(2+(line_end*(x-1))),4])))
-        df2.insert(0,'Longitude',dfT.iloc[(3+(line_end*x)),1])
-        df2.insert(0,'Latitude',dfT.iloc[(3+(line_end*x)),0])
-        df2.insert(0,'Date_time',times[x])
-        df2.insert(0,'Profile', x+1)
-        for y in range(1, len(df2)):
-            if df2.iloc[y,19]>100:
-                df2.iloc[y, 7:14] = 'nan'
-        df1 = df1.append(df2)
-    df1 = pd.DataFrame(df1, columns=['Profile', 'Date_time', 'Latitude', 'Longitude', 'Delta_DMG','Avg_depth', 'Bin_depth',
-                                     'V', 'ADP_heading', 'Water_dir', 'V_x', 'V_y', 'V_z', 'Flag'])
-    df1 = df1.astype({'Latitude':'float','Longitude':'float','Delta_DMG':'float','Avg_depth':'float','Bin_depth':'float',
-                    'V':'float','ADP_heading':'float','Water_dir':'float','V_x':'float','V_y':'float','V_z':'float','Flag':'float'})
-    df1['Longitude'] = df1['Longitude']*100
-    df1['Delta_DMG'] = df1['Delta_DMG']*100
-    return df1
+    dfT = pd.read_csv(str(filename), sep=r'\s+', names=T_COLUMNS)
+    line_end, start_time, interval = t_header(dfT)
+    df, last_dmg = t_block(dfT, line_end, start_time, interval, flag_max=flag_max)
+    return df
+
+def t_header(dfT):
+    """
+    Profile length and timing from the first 6 lines of a .T file (read with names=T_COLUMNS)
+
+    OUTPUTS
+    - line_end: number of lines per profile (6 header lines + one per depth cell)
+    - start_time: time of the first profile
+    - interval: seconds between profiles
+    """
+    line_end = int(float(dfT.iloc[5,0])) + 6
+    start_time = pd.Timestamp(*[int(float(v)) for v in dfT.iloc[0,0:6]])
+    interval = float(dfT.iloc[3,2])
+    return line_end, start_time, interval
+
+def t_block(dfT, line_end, start_time, interval, first_profile=1, last_dmg=None, flag_max=100):
+    """
+    Builds the t_reader rows for the whole profiles in a block of .T file lines. Lines after the last whole profile are ignored.
+
+    INPUTS
+    - dfT: .T file lines read with names=T_COLUMNS, starting at the first line of a profile
+    - line_end, start_time, interval: from t_header
+    - first_profile: number of the first profile in the block (1 for the start of the file)
+    - last_dmg: distance made good of the profile before the block, None at the start of the file
+    - flag_max: largest flag value of a good depth cell
+
+    OUTPUTS
+    - t_reader dataframe of the block
+    - distance made good of the last profile in the block (pass it on as last_dmg for the next block)
+    """
+    n_profiles = len(dfT) // line_end
+    n_cells = line_end - 6
+    times = start_time + pd.to_timedelta((np.arange(n_profiles) + first_profile - 1) * interval, unit='s')
+
+    # every column as a (profile, line) array; velocities as float32 cm/s -> m/s like the original reader
+    cols = {}
+    for name in T_COLUMNS:
+        if name in T_VELOCITIES:
+            col = pd.to_numeric(dfT[name], errors="coerce", downcast="float").to_numpy() / 100
+        else:
+            col = pd.to_numeric(dfT[name], errors="coerce").to_numpy(dtype=float)
+        cols[name] = col[:n_profiles*line_end].reshape(n_profiles, line_end)
+
+    def header(name, line):
+        # one value per profile, repeated for each of its cells
+        return np.repeat(cols[name][:,line], n_cells)
+
+    def cells(name):
+        return cols[name][:,6:].astype(float).ravel()
+
+    dmg = cols["V_y"][:,2]
+    if last_dmg is None:
+        delta_dmg = np.concatenate([dmg[:1], np.diff(dmg)])
+    else:
+        delta_dmg = np.diff(np.concatenate([[last_dmg], dmg]))
+    avg_depth = np.mean(np.stack([cols["8"][:,1], cols["9"][:,1], cols["10"][:,1]], axis=1), axis=1)
+
+    out = {'Profile': np.repeat(np.arange(first_profile, first_profile+n_profiles), n_cells),
+           'Date_time': np.repeat(times, n_cells),
+           'Latitude': header("Bin_depth", 3),
+           'Longitude': header("V", 3).astype(float)*100,
+           'Delta_DMG': np.repeat(delta_dmg, n_cells).astype(float)*100,
+           'Avg_depth': np.repeat(avg_depth, n_cells),
+           'Bin_depth': cells("Bin_depth"),
+           'V': cells("V"),
+           'ADP_heading': header("11", 0),
+           'Water_dir': cells("Water_dir"),
+           'V_x': cells("V_x"),
+           'V_y': cells("V_y"),
+           'V_z': cells("V_z"),
+           'Flag': cells("Flag")}
+
+    flagged = (cols["Flag"][:,6:] > flag_max)
+    flagged[:,0] = False
+    flagged = flagged.ravel()
+    for name in ['V', 'ADP_heading', 'Water_dir', 'V_x', 'V_y', 'V_z']:
+        out[name][flagged] = np.nan
+
+    index = dfT.index.to_numpy()[:n_profiles*line_end].reshape(n_profiles, line_end)[:,6:].ravel()
+    return pd.DataFrame(out, columns=T_READER_COLUMNS, index=index), (dmg[-1] if n_profiles else last_dmg)
+
+def t_stream(filename, profiles=1, flag_max=100):
+    """
+    Reads a .T file a block of profiles at a time, so memory use does not grow with the length of the file.
+
+    INPUTS
+    - filename of .T file converted into read_csv
+    - profiles: number of profiles in each block
+    - flag_max: largest flag value of a good depth cell
+
+    OUTPUTS
+    - generator of t_reader dataframes, one per block; put together they are the same as t_reader(filename)
+
+    EXAMPLE
+    for block in t_stream('B8.T', profiles=100):
+        print(block['Profile'].iloc[0], np.nanmean(block['V']))
+    """
+    line_end, start_time, interval = t_header(pd.read_csv(str(filename), sep=r'\s+', names=T_COLUMNS, nrows=6))
+    first_profile = 1
+    last_dmg = None
+    for dfT in pd.read_csv(str(filename), sep=r'\s+', names=T_COLUMNS, chunksize=line_end*profiles):
+        df, last_dmg = t_block(dfT, line_end, start_time, interval, first_profile, last_dmg, flag_max)
+        if len(df) == 0:
+            break
+        first_profile = first_profile + len(dfT) // line_end
+        yield df
+
+def t_reader_to_csv(filename, out_file, profiles=500, flag_max=100):
+    """
+    Out-of-core t_reader: writes the t_reader dataframe of a .T file straight to a .csv a block of profiles at a time,
+    without holding the whole file in memory
+
+    INPUTS
+    - filename of .T file converted into read_csv
+    - out_file: .csv file written (replaced if it exists)
+    - profiles: number of profiles held in memory at once
+    - flag_max: largest flag value of a good depth cell
+
+    OUTPUTS
+    - number of profiles written
+    """
+    n = 0
+    for block in t_stream(filename, profiles, flag_max):
+        block.to_csv(out_file, mode='w' if n == 0 else 'a', header=(n == 0), index=False)
+        n = block['Profile'].iloc[-1]
+    return n
 
 def T_transect_bearing(dfT):
     """
@@ -91,10 +193,10 @@ def T_transect_bearing(dfT):
       float
     """
 
-    lat1 = math.radians(np.float(dfT.iloc[0,2]))
-    lat2 = math.radians(np.float(dfT.iloc[-1,2]))
+    lat1 = math.radians(float(dfT.iloc[0,2]))
+    lat2 = math.radians(float(dfT.iloc[-1,2]))
 
-    diffLong = math.radians(np.float(dfT.iloc[-1,3]) - np.float(dfT.iloc[0,3]))
+    diffLong = math.radians(float(dfT.iloc[-1,3]) - float(dfT.iloc[0,3]))
 
     x = math.sin(diffLong) * math.cos(lat2)
     y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1)
@@ -107,7 +209,7 @@ def T_transect_bearing(dfT):
     # The solution is to normalize the initial bearing as shown below
     initial_bearing = math.degrees(initial_bearing)
     compass_bearing = (initial_bearing + 360) % 360
-    compass_bearing = np.float(compass_bearing)
+    compass_bearing = float(compass_bearing)
 
     return compass_bearing
 
@@ -136,28 +238,113 @@ def tfile_Qest(tr_df):
         to ENU coordinates is 240 degrees
     """
     bearing = T_transect_bearing(tr_df)
-    TWD_list = []
-    V_cs = []
-    Q = []
-    for x in range(0,len(tr_df)):
-        if (tr_df.iloc[x,8] + tr_df.iloc[x,9] <= 360):
-            TWD_list.append(tr_df.iloc[x,8] + tr_df.iloc[x,9])
-        else:
-            TWD_list.append((tr_df.iloc[x,8] + tr_df.iloc[x,9]) - 360)
-    for i in range(0,len(TWD_list)):
-        TWD = TWD_list[i]
-        V = tr_df.iloc[i,7]
-        V_cs.append(math.sin(math.radians(bearing - TWD)) *  V)
-
-    for y in range(0,len(tr_df)):
-        Q.append(tr_df.iloc[y,4] * (tr_df.iloc[1,6]-tr_df.iloc[0,6]) * V_cs[y])
+    TWD = true_water_direction(tr_df['ADP_heading'].to_numpy(dtype=float), tr_df['Water_dir'].to_numpy(dtype=float))
+    V_cs = np.sin(np.radians(bearing - TWD)) * tr_df['V'].to_numpy(dtype=float)
+    dz = tr_df['Bin_depth'].iloc[1] - tr_df['Bin_depth'].iloc[0]
+    Q = tr_df['Delta_DMG'].to_numpy(dtype=float) * dz * V_cs
 
     tr_df.insert(10, 'V_cs', V_cs)
-    tr_df.insert(10, 'TWD', TWD_list)
+    tr_df.insert(10, 'TWD', TWD)
     tr_df.insert(15, 'Q_est', Q)
     return tr_df
 
+def true_water_direction(heading, water_dir):
+    """
+    Water direction relative to ENU coordinates from the ADP heading and the XYZ water direction, wrapped to 360 degrees
+    (NaN stays NaN). Works on whole arrays.
+    """
+    TWD = heading + water_dir
+    return np.where(TWD <= 360, TWD, TWD - 360)
+
 #=============================================== DIS file functions =====================================================================================================
+# % lines of the .dis file header -> keys of the dis_parse header dictionary
+DIS_HEADER = {'ADP Data File': 'ADP_file', 'Start Date + Time': 'Start_time',
+              'All Track Calculations use': 'Track_reference', 'All Flow Velocities Relative to': 'Flow_reference'}
+
+def dis_parse(filename, parse_dates=True):
+    """
+    Reads a cleaned up .dis file csv once and returns the profile table with the metadata of the % header and of the
+    discharge summary footer. The profile table is everything between the header and the first % line after it, so it
+    is read with the fast C parser (no skipfooter) and does not depend on the number of header or footer lines.
+
+    INPUTS
+    - filename: cleaned up .dis file as csv (find example template in project appendix or in github)
+    - parse_dates: Date and Time columns as datetimes like dis_reader, False to keep the text of the file
+
+    OUTPUTS
+    - dis_df: every profile of the file (no DQI filter)
+    - header: {'ADP_file': .adp file name, 'Start_time': Timestamp, 'Track_reference': e.g. 'Bottom Track data',
+               'Flow_reference': e.g. 'Bottom Track', 'Units': e.g. 'Metric'}
+    - footer: discharge summary {'Top_Q', 'Measured_Q', 'Bottom_Q', 'Left_Q', 'Right_Q', 'Total_Q' (m^3/s),
+               'MeasQ/EstQ' (%), 'TotalArea' (m^2), 'MeanVel' (m/s)}
+    """
+    with open(str(filename), encoding='utf-8-sig') as f:
+        lines = f.read().splitlines()
+    start = 0
+    while start < len(lines) and lines[start].startswith('%'):
+        start = start + 1
+    end = start + 1
+    while end < len(lines) and not lines[end].startswith('%'):
+        end = end + 1
+
+    header = {}
+    for line in lines[:start]:
+        words = [w for w in line.split(',')[1:] if w != '']
+        text = ' '.join(words)
+        if ':' in text:
+            key, value = [t.strip() for t in text.split(':', 1)]
+            header[DIS_HEADER.get(key, key)] = value
+        elif len(words) == 2 and words[1] == 'Units':
+            header['Units'] = words[0]
+    if 'Start_time' in header:
+        header['Start_time'] = pd.to_datetime(header['Start_time'], dayfirst=True)
+
+    footer = {}
+    for line in lines[end:]:
+        words = [w for w in line.split(',')[1:] if w != '']
+        if '=' in words and words.index('=') + 1 < len(words):
+            i = words.index('=')
+            footer['_'.join(words[:i])] = float(words[i+1])
+
+    dis_df = pd.read_csv(io.StringIO('\n'.join(lines[start:end])), delimiter=',',
+                         parse_dates=[1,2] if parse_dates else None)
+    return dis_df, header, footer
+
+DIS_DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y']
+
+def dis_timestamps(dis_df):
+    """
+    Date and Time text columns of a dis_parse(parse_dates=False) dataframe as one timestamp per profile. The date
+    formats of DIS_DATE_FORMATS are tried in order (files re-saved in Excel use month/day/year)
+    """
+    text = dis_df['Date'].astype(str).str.strip() + ' ' + dis_df['Time'].astype(str).str.strip()
+    for date_format in DIS_DATE_FORMATS:
+        try:
+            return pd.to_datetime(text, format=date_format + ' %H:%M:%S')
+        except ValueError:
+            pass
+    raise ValueError('Unknown date format in the .dis file: ' + str(dis_df['Date'].iloc[0]))
+
+def dis_summary(dis_df):
+    """
+    dis_filter summary of a (DQI filtered) dis_reader dataframe, without reading the file again. The cross-sectional
+    area is the sum of each profile's distance made good step times its average depth.
+
+    OUTPUTS
+    - date, time, bearing, max_depth, vel_avg, dir_avg, q_sum, total_area (see dis_filter)
+    """
+    date = dis_df.iloc[0,1]
+    time = dis_df.iloc[0,2]
+    bearing = dis_transect_bearing(dis_df)
+    max_depth = np.max(dis_df['AvDepth(m)'])
+    vel_avg = np.mean(dis_df['uFlow(m/s)'])
+    dir_avg = np.mean(dis_df['DirFlow(deg)'])
+    q_sum = np.sum(dis_df['Q(m^3/s)'])
+    dmg = dis_df['DMG(m)'].to_numpy(dtype=float)
+    area = np.diff(dmg, prepend=0) * dis_df['AvDepth(m)'].to_numpy(dtype=float)
+    total_area = np.cumsum(area)[-1]
+    return date, time, bearing, max_depth, vel_avg, dir_avg, q_sum, total_area
+
 def dis_reader(filename):
     """
     Takes cleaned up .dis file csv and repackages with date_time column and all
@@ -169,7 +356,7 @@ def dis_reader(filename):
     OUTPUTS
     - Filter .dis file as a readable dataframe
     """
-    dis_df = pd.read_csv(str(filename), delimiter=',', skiprows=[3], header=4, skipfooter = 15, parse_dates=[1,2])
+    dis_df, header, footer = dis_parse(filename)
     dis_df= dis_df[dis_df['DQI'] < 4]
     return dis_df
 
@@ -210,24 +397,12 @@ def dis_transect_bearing(disfile):
     return compass_bearing
 
 def dis_filter(filename):
-"""
-Takes dis_reader dataframe AS A CSV and returns useful information
-"""
-
-    df = pd.read_csv(str(filename), delimiter=',', skiprows=[3], header=4, skipfooter = 15)
+    """
+    Takes dis_reader dataframe AS A CSV and returns useful information (see dis_summary for a table that is already read)
+    """
+    df, header, footer = dis_parse(filename, parse_dates=False)
     df= df[df['DQI'] < 4]
-    date = df.iloc[0,1]
-    time = df.iloc[0,2]
-    bearing = dis_transect_bearing(df)
-    max_depth= np.max(df['AvDepth(m)'])
-    vel_avg = np.mean(df['uFlow(m/s)'])
-    dir_avg = np.mean(df['DirFlow(deg)'])
-    q_sum = np.sum(df['Q(m^3/s)'])
-    total_area = df.iloc[0,4] * df.iloc[0,12]
-    for x in range(1,len(df)):
-        area = (df.iloc[x,4]-df.iloc[x-1,4]) * df.iloc[x,12]
-        total_area = total_area+area
-    return date, time, bearing, max_depth, vel_avg, dir_avg, q_sum, total_area
+    return dis_summary(df)
 
 #=============================================== post analysis functions =====================================================================================================
 
@@ -248,49 +423,292 @@ def Qnorm(tr_df, dis_df, dt):
     """
     dis_df_sub = dis_df[['Profile', 'uVess(m/s)', 'DirVess(deg)']]
     df_merge = pd.merge(tr_df, dis_df_sub, how='inner', on="Profile")
-    Qn = []
-    Vn = []
-    TVD = []
-    dt = dt
-    dz = df_merge.iloc[1,6] - df_merge.iloc[0,6]
-
-    for x in range(0,len(df_merge)):
-        if (df_merge.iloc[x,8] + df_merge.iloc[x,9] <= 360):
-            TVD.append(df_merge.iloc[x,8] + df_merge.iloc[x,18])
-        else:
-            TVD.append((df_merge.iloc[x,8] + df_merge.iloc[x,18]) - 360)
+    dz = df_merge['Bin_depth'].iloc[1] - df_merge['Bin_depth'].iloc[0]
 
-    for y in range(0,len(df_merge)):
-        theta = TVD[y]-df_merge.iloc[y,10]
-        Qn.append((df_merge.iloc[y,7] * df_merge.iloc[y,17] * math.sin(math.radians(theta)) *  dt * dz))
+    heading = df_merge['ADP_heading'].to_numpy(dtype=float)
+    DirVess = df_merge['DirVess(deg)'].to_numpy(dtype=float)
+    V = df_merge['V'].to_numpy(dtype=float)
+    TWD = df_merge['TWD'].to_numpy(dtype=float)
+    # the vessel direction is wrapped whenever the water direction sum (heading + Water_dir) is over 360
+    TVD = np.where(heading + df_merge['Water_dir'].to_numpy(dtype=float) <= 360, heading + DirVess, (heading + DirVess) - 360)
 
-    for i in range(0,len(df_merge)):
-        phi = TVD[i]-df_merge.iloc[i, 10] + 90
-        Vn.append((df_merge.iloc[i,7] * math.cos(math.radians(phi))))
+    theta = TVD - TWD
+    Qn = V * df_merge['uVess(m/s)'].to_numpy(dtype=float) * np.sin(np.radians(theta)) * dt * dz
+    phi = TVD - TWD + 90
+    Vn = V * np.cos(np.radians(phi))
 
     df_merge.insert(19, 'Qn', Qn)
     df_merge.insert(19, 'Vn', Vn)
 
     return df_merge
 
-def dp_conversion(dfQ):
+def dp_conversion(dfQ, float32=False):
     """
     Converts master dataframe from Qnorm function into an xarray dataset, which is more easily accessible for depth-profile visualization
 
     INPUTS
     - Master dataframe from Qnorm function (df_merge)
+    - float32: store the variables as float32 (half the memory) instead of float64
 
     OUTPUTS
     - xarray dataset with cross-sectional and normalized velocities and discharge rates, organized by profile number and depth bin
     """
-    unique_depth = np.unique(dfQ['Bin_depth'])
-    unique_profile = np.unique(dfQ['Profile'])
-    pivoted_V = dfQ.pivot(index='Profile',columns='Bin_depth',values='V')
-    pivoted_Vcs = dfQ.pivot(index='Profile',columns='Bin_depth',values='V_cs')
-    pivoted_Qest = dfQ.pivot(index='Profile',columns='Bin_depth',values='Q_est')
-    pivoted_Vn = dfQ.pivot(index='Profile',columns='Bin_depth',values='Vn')
-    pivoted_Qn = dfQ.pivot(index='Profile',columns='Bin_depth',values='Qn')
-    dsQ = xr.Dataset({'V': (('profile', 'depth'), pivoted_V),'V_cs': (('profile', 'depth'), pivoted_Vcs), 'Q_est': (('profile', 'depth'), pivoted_Qest),
-                     'Vn': (('profile', 'depth'), pivoted_Vn), 'Qn': (('profile', 'depth'), pivoted_Qn)},
-                       {'profile': unique_profile, 'depth':unique_depth})
-    return dsQ
+    return grid_profiles(dfQ, ['V', 'V_cs', 'Q_est', 'Vn', 'Qn'], float32=float32)
+
+def grid_profiles(df, variables, index='Profile', columns='Bin_depth', dims=('profile', 'depth'), float32=False):
+    """
+    Dense (profile x depth) xarray dataset of any number of columns of a long dataframe, the same as one DataFrame.pivot per
+    variable but the profile and depth positions of the rows are found once and all variables are filled in one step
+
+    INPUTS
+    - df: dataframe with one row per depth cell (e.g. from t_reader, Qnorm or a processed velocity csv)
+    - variables: names of the columns to grid
+    - index, columns: columns giving the position of each row (coordinates of the first and second dimension)
+    - dims: names of the two dimensions of the dataset
+    - float32: store the variables as float32 instead of float64
+
+    OUTPUTS
+    - xarray dataset with one (dims) variable per column, sorted coordinates and nan where a cell has no row
+
+    EXAMPLE
+    ds = grid_profiles(pd.read_csv('B8NS.csv'), ['V_x', 'V_y'], index='date_time', columns='depth', dims=('time', 'depth'))
+    """
+    rows, row = np.unique(df[index].to_numpy(), return_inverse=True)
+    cols, col = np.unique(df[columns].to_numpy(), return_inverse=True)
+    cell = row.ravel() * len(cols) + col.ravel()
+    if np.bincount(cell, minlength=len(rows)*len(cols)).max(initial=0) > 1:
+        raise ValueError('Index contains duplicate entries, cannot reshape')
+
+    dtype = np.float32 if float32 else float
+    cube = np.full((len(variables), len(rows)*len(cols)), np.nan, dtype=dtype)
+    cube[:, cell] = df[list(variables)].to_numpy(dtype=dtype).T
+    cube = cube.reshape(len(variables), len(rows), len(cols))
+    return xr.Dataset(dict((name, (dims, cube[i])) for i, name in enumerate(variables)),
+                      {dims[0]: rows, dims[1]: cols})
+
+#=============================================== cache functions =====================================================================================================
+
+CACHE_VERSION = 1   # part of every key, bump it when a change to the functions above changes their output
+
+class ProductCache:
+    """
+    On-disk cache of t_reader, dis_reader, tfile_Qest, Qnorm and dp_conversion results, so a notebook session does not
+    re-parse and recompute the same transect every time
+
+    - Keys are the SHA-1 of the input files' contents plus the processing parameters (dt, flag_max), so a changed file
+      or parameter is a different key and stale results are never returned
+    - Products are pickled dataframes/datasets, one file per key
+    - When the cache grows over max_bytes the least recently used products are deleted
+
+    INPUTS
+    - directory: folder of the cache files (created if needed)
+    - max_bytes: size limit of the cache
+
+    EXAMPLE
+    cache = ProductCache('ADP_cache')
+    dsQ = cache.dp_conversion('B8.T', 'B8dis.csv', dt=1)     # computed and stored the first time, loaded after that
+    """
+    def __init__(self, directory='ADP_cache', max_bytes=2*1024**3):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hashes = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def file_hash(self, filename):
+        # hash of a file's contents, only recomputed when its size or modification time changes
+        filename = os.path.abspath(str(filename))
+        st = os.stat(filename)
+        stamp = (st.st_size, st.st_mtime_ns)
+        if self.hashes.get(filename, (None,))[0] != stamp:
+            h = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1024**2), b''):
+                    h.update(block)
+            self.hashes[filename] = (stamp, h.hexdigest())
+        return self.hashes[filename][1]
+
+    def key(self, product, files, **params):
+        """
+        Cache key of a product made from the given input files with the given parameters
+        """
+        text = json.dumps([CACHE_VERSION, product, [self.file_hash(f) for f in files], sorted(params.items())], default=str)
+        return product + '_' + hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """
+        Stored product of a key, None if it is not in the cache. A file that cannot be loaded (e.g. a pickle
+        written by an older pandas or numpy) is deleted and counts as not in the cache.
+        """
+        try:
+            with open(self.path(key), 'rb') as f:
+                obj = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError, TypeError):
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            return None
+        os.utime(self.path(key))   # the modification time is the last use for the LRU eviction
+        return obj
+
+    def put(self, key, obj):
+        tmp = self.path(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used products until the cache is under max_bytes
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime_ns, st.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total = total - size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.directory, name))
+
+    def cached(self, product, files, fcn, **params):
+        """
+        Product from the cache, or fcn() stored under the key of (product, files, params) when it is not there
+        """
+        key = self.key(product, files, **params)
+        obj = self.get(key)
+        if obj is None:
+            obj = fcn()
+            self.put(key, obj)
+        return obj
+
+    # each product is built from the cached product before it, so e.g. a new dt only recomputes Qnorm
+    def t_reader(self, t_file, flag_max=100):
+        return self.cached('t_reader', [t_file], lambda: t_reader(t_file, flag_max), flag_max=flag_max)
+
+    def dis_reader(self, dis_file):
+        return self.cached('dis_reader', [dis_file], lambda: dis_reader(dis_file))
+
+    def tfile_Qest(self, t_file, flag_max=100):
+        return self.cached('tfile_Qest', [t_file], lambda: tfile_Qest(self.t_reader(t_file, flag_max)), flag_max=flag_max)
+
+    def Qnorm(self, t_file, dis_file, dt, flag_max=100):
+        return self.cached('Qnorm', [t_file, dis_file],
+                           lambda: Qnorm(self.tfile_Qest(t_file, flag_max), self.dis_reader(dis_file), dt),
+                           dt=dt, flag_max=flag_max)
+
+    def dp_conversion(self, t_file, dis_file, dt, flag_max=100, float32=False):
+        return self.cached('dp_conversion', [t_file, dis_file],
+                           lambda: dp_conversion(self.Qnorm(t_file, dis_file, dt, flag_max), float32),
+                           dt=dt, flag_max=flag_max, float32=float32)
+
+#=============================================== batch functions =====================================================================================================
+
+SUMMARY_COLUMNS = ['Transect', 'Date', 'Time', 'Bearing', 'Max_depth', 'Vel_avg', 'Dir_avg', 'Q_sum', 'Total_area',
+                   'Profiles', 'Qn_sum', 'Total_Q', 'ADP_file', 'Dis_file', 'Velocity_file', 'Output_file']
+
+def find_transects(directory):
+    """
+    Finds the transects in a survey directory: every <name>dis.csv with a velocity file of the same name,
+    either a .T file (<name>*.T) or a processed velocity csv (<name>NS.csv, <name>SN.csv or <name>NS_SN.csv)
+
+    OUTPUTS
+    - list of (name, dis file, velocity file), sorted by name
+    """
+    transects = []
+    for dis_file in sorted(glob.glob(os.path.join(str(directory), '*dis.csv'))):
+        name = os.path.basename(dis_file)[:-len('dis.csv')]
+        velocity = sorted(glob.glob(os.path.join(str(directory), glob.escape(name) + '*.T')))
+        if not velocity:
+            velocity = [f for f in sorted(glob.glob(os.path.join(str(directory), glob.escape(name) + '*.csv')))
+                        if re.fullmatch(re.escape(name) + r'(NS|SN|NS_SN)\.csv', os.path.basename(f))]
+        if velocity:
+            transects.append((name, dis_file, velocity[0]))
+    return transects
+
+def process_transect(name, dis_file, velocity_file, out_dir=None):
+    """
+    Processes one transect and returns its row of the survey summary table
+
+    - .T velocity file: t_reader -> tfile_Qest -> Qnorm (dt from the .T file), the master dataframe is written to <out_dir>/<name>_Qnorm.csv
+    - processed velocity csv: the depth averaged velocities of each profile are merged with the filtered .dis profiles
+      and written to <out_dir>/<name>_profiles.csv
+
+    The discharge summary (date, time, bearing, max depth, mean velocity and direction, Q and area) comes from dis_summary,
+    Total_Q (with the top, bottom and edge estimates) and ADP_file from the .dis file footer and header
+    """
+    dis_df, header, footer = dis_parse(dis_file, parse_dates=False)
+    dis_df = dis_df[dis_df['DQI'] < 4]
+    date, time, bearing, max_depth, vel_avg, dir_avg, q_sum, total_area = dis_summary(dis_df)
+    stamp = dis_timestamps(dis_df)
+    dis_df = dis_df.assign(Date=stamp.dt.normalize(), Time=stamp)
+    Qn_sum = np.nan
+    if velocity_file.endswith('.T'):
+        line_end, start_time, interval = t_header(pd.read_csv(velocity_file, sep=r'\s+', names=T_COLUMNS, nrows=6))
+        out = Qnorm(tfile_Qest(t_reader(velocity_file)), dis_df, interval)
+        Qn_sum = np.nansum(out['Qn'])
+        suffix = '_Qnorm.csv'
+    else:
+        vel = pd.read_csv(velocity_file)
+        profile_mean = vel.groupby('profile')[['V_x', 'V_y', 'V_z']].mean().add_suffix('_mean')
+        out = pd.merge(dis_df, profile_mean, how='inner', left_on='Profile', right_index=True)
+        suffix = '_profiles.csv'
+    output_file = None
+    if out_dir is not None:
+        output_file = os.path.join(str(out_dir), name + suffix)
+        out.to_csv(output_file, index=False)
+    return {'Transect': name, 'Date': date, 'Time': time, 'Bearing': bearing, 'Max_depth': float(max_depth),
+            'Vel_avg': float(vel_avg), 'Dir_avg': float(dir_avg), 'Q_sum': float(q_sum), 'Total_area': float(total_area),
+            'Profiles': len(dis_df), 'Qn_sum': float(Qn_sum), 'Total_Q': footer.get('Total_Q', np.nan),
+            'ADP_file': header.get('ADP_file'), 'Dis_file': dis_file, 'Velocity_file': velocity_file,
+            'Output_file': output_file}
+
+def batch_discharge(directory, out_dir=None, workers=None):
+    """
+    Processes every transect of a survey directory in parallel, one transect per process
+
+    INPUTS
+    - directory: folder with the .dis csv and velocity files (e.g. processed_data)
+    - out_dir: folder for the per-transect outputs and summary.csv, None to only return the summary
+    - workers: number of processes, all cores by default
+
+    OUTPUTS
+    - summary dataframe with one row per transect (see process_transect)
+    """
+    transects = find_transects(directory)
+    if out_dir is not None:
+        os.makedirs(str(out_dir), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_transect, name, dis_file, velocity_file, out_dir)
+                   for name, dis_file, velocity_file in transects]
+        rows = []
+        for (name, dis_file, velocity_file), future in zip(transects, futures):
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                print('Could not process ' + name + ': ' + repr(e))
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    if out_dir is not None:
+        summary.to_csv(os.path.join(str(out_dir), 'summary.csv'), index=False)
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process every ADP transect in a survey directory')
+    parser.add_argument('directory', nargs='?', default='processed_data', help='folder with the .dis csv and velocity files')
+    parser.add_argument('--output', default='ADP_output', help='folder for the per-transect outputs and summary.csv')
+    parser.add_argument('--workers', type=int, help='number of processes (default: all cores)')
+    args = parser.parse_args()
+    print(batch_discharge(args.directory, args.output, args.workers).to_string())
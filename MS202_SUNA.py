@@ -11,6 +11,7 @@ import serial
 from datetime import datetime
 import time
 import csv
+import udas_logger
 
 def getSUNA(suna,nsample):
     '''
@@ -95,33 +96,22 @@ def getSUNA(suna,nsample):
         print ('No data received from SUNA.'+'\n')
         return ('NA','NA')
 
-# Create CSV File with proper headers
-file_time = datetime.now()
-file_name = 'SUNA/SUNA_'+str(file_time)+'.csv'
-f = open(file_name,'w')
-header = csv.writer(f)
-header.writerow(['Time (PST)','Nitrate (uM)','Nitrogen (mg/L)'])
-f.close()
+# Create CSV File with proper headers. Rows are buffered and written every few samples (see udas_logger.py).
+log = udas_logger.UDASLogWriter('SUNA/SUNA_', ['Time (PST)','Nitrate (uM)','Nitrogen (mg/L)'], flush_rows=4, flush_interval=60)
 
 ##loops through getSUNA function indefinitely and stores to CSV. 
-while True:
+#Ctrl-C stops the loop; the rows still in the buffer are written before the program exits
+try:
+    while True:
 
-    COM_SUNA = '/dev/ttyUSB0'  # COM port
-    nsample = 5       # number of light frames averaged together - should be greater than 4.
-    sensor = serial.Serial(COM_SUNA,57600,timeout=10)
-    nitrate_uM,nitrogen = getSUNA(sensor,nsample)
-    sensor.close() 
+        COM_SUNA = '/dev/ttyUSB0'  # COM port
+        nsample = 5       # number of light frames averaged together - should be greater than 4.
+        sensor = serial.Serial(COM_SUNA,57600,timeout=10)
+        nitrate_uM,nitrogen = getSUNA(sensor,nsample)
+        sensor.close() 
   
-    ##Adds data to CSV file
-    f = open(file_name,'a')
-    writer = csv.writer(f)
-    time_now = datetime.now()
-    writer.writerow([str(time_now),nitrate_uM,nitrogen])
-        
-    f.close()
-
-
-
-    
-    
-
+        ##Adds data to CSV file
+        time_now = datetime.now()
+        log.writerow([str(time_now),nitrate_uM,nitrogen])
+finally:
+    log.close()
@@ -1,51 +1,45 @@
 from datetime import datetime
 import time as t
-import csv
-import serial
+import UDAS_FCNS_Module as udas
+import udas_serial
+import udas_parsers
+import udas_logger
 
 
 def getTSG(TSG_sensor):
     '''Obtain temperature, conducivity, and practical salinity measurments from TSG sensor.
+        Everything waiting on the port is read and only the newest line is kept, so the values are
+        never older than the time between calls.
         
         INPUTS:
-           TSG_sensor - a serial object
+           TSG_sensor - a udas_serial.SerialConnection
         
         RETURNS:
         temperature (Celsius)
         conductivity
         salinity
         '''
-    try:
-        data = TSGsensor.readline().decode()
-        split = data.split(',')
-        Temp = split[0].replace(',','')
-        Conductivity = split[1].replace(',','')
-        Salinity = split[2].replace(',','')
-        
-        print(Temp,Conductivity,Salinity)
-        return Temp,Conductivity,Salinity
-            
-    except:
+    Temp,Conductivity,Salinity = udas.read_newest(TSG_sensor, udas_parsers.TSG_SPEC)
+    if Temp == 'nan':
         print('No data collected')
-        Temp = 'nan'
-        Conductivity = 'nan'
-        Salinity = 'nan'
-        return Temp,Conductivity,Salinity
+    else:
+        print(Temp,Conductivity,Salinity)
+    return Temp,Conductivity,Salinity
         
 
-f = open('TSG_UDAS.csv','w')
-header = csv.writer(f)
-header.writerow(['Time (PST)','TempC','Conductivity', 'Salinity'])
-f.close()
+#Rows are buffered and written to the file every 10 samples or 30 seconds (see udas_logger.py)
+log = udas_logger.UDASLogWriter('TSG_UDAS_', ['Time (PST)','TempC','Conductivity', 'Salinity'], flush_rows=10, flush_interval=30)
+
+TSG_port = '/dev/ttyUSB0'
+TSGsensor = udas_serial.SerialConnection(TSG_port, 38400, timeout=1) #waits 1 second between measurements. Opened once and kept open.
 
-while True:
-    TSG_port = '/dev/ttyUSB0'
-    TSGsensor = serial.Serial(TSG_port, 38400, timeout=1) #waits 1 second between measurements. Specifies USB port and baud rate. 
-    Temp,Conductivity,Salinity = getTSG(TSGsensor)
-    time = datetime.now()
+#Ctrl-C stops the loop; the rows still in the buffer are written before the program exits
+try:
+    while True:
+        Temp,Conductivity,Salinity = getTSG(TSGsensor)
+        time = datetime.now()
     
-    f = open('TSG_UDAS.csv','a')
-    writer = csv.writer(f)
-    writer.writerow([str(time),Temp,Conductivity,Salinity])
-    t.sleep(3)
-    f.close()
+        log.writerow([str(time),Temp,Conductivity,Salinity])
+        t.sleep(3)
+finally:
+    log.close()
@@ -1,28 +1,27 @@
-import serial
 import time
-import csv
 from datetime import datetime
+import udas_serial
+import udas_logger
 
 port = '/dev/ttyUSB0'
 baud = 19200
 
-filename = str('transmissometer'+str(datetime.now())+'.csv')
-file_init = open(filename,'w')
-writer = csv.writer(file_init)
+#Rows are buffered and written to the file every 10 samples (see udas_logger.py)
 header = ['Datetime', 'Transmission']
-writer.writerow(header)
-file_init.close()
+log = udas_logger.UDASLogWriter('transmissometer', header, flush_rows=10, flush_interval=10)
 
-i=1
-for i in range(61):
-    with serial.Serial(port,baud,timeout=1) as sensor:
-        data = sensor.readline().decode()
+sensor = udas_serial.SerialConnection(port,baud,timeout=1) #opened once and kept open for all readings
+
+#Ctrl-C stops the loop; the rows still in the buffer are written before the program exits
+try:
+    for i in range(61):
+        data = sensor.readline().decode(errors='replace')
         index = data.split()
+        if len(index) < 5:
+            #timeout or partial line: nothing to log
+            continue
         timestamp = datetime.now()
-        time.sleep(0.70)
-    print(timestamp,index[4])
-    i = i+1
-    f = open(filename,'a')
-    writer = csv.writer(f)
-    writer.writerow([str(timestamp), str(index[4])])
-    f.close()
\ No newline at end of file
+        print(timestamp,index[4])
+        log.writerow([str(timestamp), str(index[4])])
+finally:
+    log.close()
@@ -6,11 +6,8 @@ import serial
 from datetime import datetime
 import time
 import csv
-import board
-import busio
-import adafruit_gps
 import io
-import pynmea2
+import udas_parsers
 
 
 
@@ -107,9 +104,7 @@ def getSUNA(suna,nsample):
             if count > nsample:
                 break
         
-        suna.close()
-        
-        
+        #The port is left open so the same connection can be used for the next measurement
         
         data = line.split(',')
         nitrate_uM = np.mean(nitrate_list)
@@ -180,14 +175,19 @@ def get_chla(chla_sensor):
 #=================================================================
 # GPS
 def get_gps(sio):
+    '''Latitude and longitude of the next NMEA sentence in signed decimal degrees (the same unit as
+        udas_gps.GPSReader), ('nan','nan') if it has no position.'''
+    import pynmea2   #only needed with a GPS, so sensor-only runs do not import it
 
     timestamp = time.monotonic()
     try:
         line = sio.readline()
         msg= pynmea2.parse(line)
-        lat = msg.lat
-        lon = msg.lon
-        return repr(msg.lat), repr(msg.lon)
+        if not msg.lat or not msg.lon:
+            return 'nan','nan'
+        lat = msg.latitude
+        lon = msg.longitude
+        return lat, lon
     except serial.SerialException as e:
         lat = 'nan'
         lon = 'nan'
@@ -207,4 +207,40 @@ def get_gps(sio):
         lat = 'nan'
         lon = 'nan'
         return lat,lon
-    
+
+
+#========================================================================================
+# Bulk reads: take everything that has queued on the port since the last call instead of one line per call,
+# so the values logged are never older than the poll interval. The sensor must be a udas_serial.SerialConnection.
+malformed_lines = {}   #count of lines that could not be parsed, per instrument
+
+def read_all(sensor, spec):
+    '''Read and parse every complete line waiting on a sensor port.
+
+        INPUTS:
+           sensor - a udas_serial.SerialConnection
+           spec - udas_parsers LineSpec of the instrument (e.g. udas_parsers.TSG_SPEC)
+
+        RETURNS:
+        list of (arrival time, values) for every good line, oldest first. values is a tuple in the order of
+        spec.fields, or a single float for one value instruments (the transmissometer).
+        '''
+    lines, arrival = sensor.read_lines()
+    result = udas_parsers.parse_lines(spec, lines)
+    if result.malformed:
+        malformed_lines[spec.name] = malformed_lines.get(spec.name, 0) + result.malformed
+        print(spec.name + ': ' + str(result.malformed) + ' malformed lines')
+    if len(spec.fields) == 1:
+        return [(arrival, row[0]) for row in result.values.tolist()]
+    return [(arrival, row) for row in result.values.tolist()]
+
+
+def read_newest(sensor, spec):
+    '''Read everything waiting on a sensor port and return only the newest good values.
+        Returns 'nan' for each value (like getTSG) when no good line was waiting.'''
+    samples = read_all(sensor, spec)
+    if samples:
+        return samples[-1][1]
+    if len(spec.fields) == 1:
+        return 'nan'
+    return tuple('nan' for field in spec.fields)
@@ -16,11 +16,11 @@ import pynmea2
 #========================================================================================
 # Fucnction to retrieve the TSG sensor Data
 # TSG sensor provides data for Temperature (C), conductivity, and salinity (PSU)
-def getTSG(TSG_port):
+def getTSG(TSG_sensor):
     '''Obtain temperature, conducivity, and practical salinity measurments from TSG sensor.
         
         INPUTS:
-           TSG_port - USB port on the Raspberry Pi the TSG is plugged into
+           TSG_sensor - a serial object (e.g. a udas_serial.SerialConnection that stays open between calls)
         
         RETURNS:
         temperature (Celsius)
@@ -28,7 +28,6 @@ def getTSG(TSG_port):
         salinity
         '''
     try:
-        TSGsensor = serial.Serial(TSG_port, 38400, timeout=5) #waits 5 seconds between measurements. Specifies baud rate. 
         data = TSG_sensor.readline().decode()
         split = data.split(',')
         data_T = float(split[0])
@@ -48,21 +47,20 @@ def getTSG(TSG_port):
 #========================================================================================
 # Function to Retrive SUNA sensor data
 # SUNA sensor provides nitrate data (NO3)
-def getSUNA(COM_SUNA,nsample):
+def getSUNA(suna,nsample):
     '''
     Obtain nitrate measurement from SUNA sensor operating in polled mode.
     
     This version has been tested on Python 3 only.
     
     INPUTS:
-    COM_SUNA - USB (or COM) port the SUNA is plugged into
+    suna - a serial object (e.g. a udas_serial.SerialConnection that stays open between calls)
     nsample - number of light samples to average
     
     RETURNS
     nitrate_uM (umol/L)
     nitrogen (mg/L)
     '''
-    suna = serial.Serial(COM_SUNA,57600,timeout=10)
     try:
         #print('Connected to SUNA'+'\n')
         suna.write(b'Waking up SUNA\n')
@@ -109,8 +107,6 @@ def getSUNA(COM_SUNA,nsample):
             if count > nsample:
                 break
         
-        suna.close()
-        
         data = line.split(',')
         nitrate_uM = np.mean(nitrate_list)
         nitrogen = np.mean(nitrogen_list)
@@ -133,16 +129,15 @@ def getSUNA(COM_SUNA,nsample):
 #========================================================================================
 # Function to retrieve data from the transmissometer sensor
 # Transmissometer sensor provides data for beam attenuation
-def get_Transmissometer(TM_port):
+def get_Transmissometer(TM_Sensor):
     '''Obtain transmisometer data from transmissometer sensor.
         Inputs:
-            TMSensor - a serial object
+            TM_Sensor - a serial object (e.g. a udas_serial.SerialConnection that stays open between calls)
         
         Outputs:
             Beam_Attenuation
         '''
     try:
-        TMsensor = serial.Serial(TM_port, 19200, timeout=1) #waits 1 second between measurements. Specifies USB port and baud rate.
         data = TM_Sensor.readline().decode()
         index = data.split()
         Beam_Attenuation = float(index[4])
@@ -155,18 +150,17 @@ def get_Transmissometer(TM_port):
 
 #========================================================================================
 #Chlorophyll 
-def get_chla(chla_port):
+def get_chla(chla_sensor):
     ''' Obtain Chlorophyl a and turbidity measurments.
         
         INPUTS:
-           chla_port - USB port on the Raspberry Pi the Fluormeter is plugged into
+           chla_sensor - a serial object (e.g. a udas_serial.SerialConnection that stays open between calls)
         
         RETURNS:
         Chl_a (chlorophyll a)
         turb (Turbidity)
     '''
     try:
-        chla_sensor = serial.Serial(chl_port, 9600, timeout=1, rtscts=1)
         data = chla_sensor.readline().decode()
         split = data.split()
         chl_a = float(split[3])
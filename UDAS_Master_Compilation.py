@@ -1,76 +1,98 @@
-import numpy as np
-import serial
-from datetime import datetime
-import time
-import csv
-import UDAS_FCNS_Module as udas
-import board
-import busio
-import adafruit_gps
-import io
-import pynmea2
-# Create CSV File with proper headers
-file_time = datetime.now()
-file_name = 'UDAS/UDAS_'+str(file_time)+'.csv'
-f = open(file_name,'w')
-header = csv.writer(f)
-header.writerow(['Time (UTC)','Time (PST)','Latitude','Longitude','TempC','Conductivity', 'Salinity','Nitrate (uM)','Nitrogen (mg/L)','Chl_a','Turbidity','Transmission'])
-f.close()
+import udas_main
 
-#=================================================================================
-#Seperate GPS variables defined
-gps_port = '/dev/ttyS0'
-ser = serial.Serial(gps_port, baudrate=9600, timeout=1)
-sio = io.TextIOWrapper(io.BufferedRWPair(ser, ser))
-# Create a GPS module instance
-gps = adafruit_gps.GPS(ser)
-# Turn on the basic GGA (the 4th digit after 'PMTK314' is a 1, denoting that GGA is 'on'. The 2nd digit would enable RMC if desired.)
-gps.send_command(b"PMTK314,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0")
-# Set update rate to once a second (1hz) which is what you typically want.
-gps.send_command(b"PMTK220,1000")
-#===================================================================================
+#Set CONCURRENT to True to read every sensor in its own worker thread (see udas_workers.py).
+#Each sensor then runs at its own rate and a slow SUNA no longer holds up the TSG, fluorometer or GPS.
+#The concurrent run is udas_main.Pipeline: its ports, rates, log format, QC, decimation, live publishing and
+#metrics are all set in CONFIG_FILE (the same as running "python udas_main.py").
+CONCURRENT = True
+CONFIG_FILE = 'udas_config.json'
 
-while True:
-    #Get data from TSG (Temp, conductivity, Salinity)
-    TSG_port = '/dev/ttyUSB2'
-    TSGsensor = serial.Serial(TSG_port, 38400, timeout=5) #waits 1 second between measurements. Specifies USB port and baud rate. 
-    Temp,Conductivity,Salinity = udas.getTSG(TSGsensor)
-    print(Temp, Conductivity, Salinity)
-    
+if CONCURRENT:
+    udas_main.Pipeline(udas_main.load_config(CONFIG_FILE)).run()
 
-    #Get Data from the SUNA Sensor (Nitrate)
-    COM_SUNA = '/dev/ttyUSB3'  # COM port for the SUNA
-    nsample = 5       # number of light frames averaged together - should be greater than 4 (SUNA).
-    SUNA_sensor = serial.Serial(COM_SUNA,57600,timeout=10)
-    nitrate_uM,nitrogen = udas.getSUNA(SUNA_sensor,nsample)
-    SUNA_sensor.close()
-    
-    #Get data from Transmissimeter
-    TM_port = '/dev/ttyUSB0'
-    TMsensor = serial.Serial(TM_port, 19200, timeout=1) #waits 1 second between measurements. Specifies USB port and baud rate. 
-    Beam_Attenuation = udas.get_Transmissometer(TMsensor)
-    
-    #Get Data from Chlorometer
-    chl_port = '/dev/ttyUSB1'
-    chla_sensor = serial.Serial(chl_port, 9600, timeout=1, rtscts=1)
-    chl_a,turb = udas.get_chla(chla_sensor)
-    #print(chl_a,turb)
-    
-    #Get gps coordinates from gps
-    lat,lon = udas.get_gps(sio)
-    
-    
-    ##Adds data to CSV file
-    f = open(file_name,'a')
-    writer = csv.writer(f)
-    time_now = datetime.now()
-    time_UTC = datetime.utcnow()
-    writer.writerow([str(time_UTC), str(time_now),lat, lon, Temp,Conductivity, Salinity,nitrate_uM,nitrogen, chl_a, turb, Beam_Attenuation])
-    time.sleep(3)  
-    f.close()
-    
-    #Print everything
-    print(str(time_now),str(lat), str(lon), str(Temp), str(Conductivity), str(Salinity),
-          str(nitrate_uM), str(nitrogen), str(chl_a), str(turb), str(Beam_Attenuation))
-    print('------------------------------------------')
-    print()
\ No newline at end of file
+else:
+    #the sequential run's modules are only imported when it is used
+    import io
+    import time
+    from datetime import datetime
+    import serial
+    import UDAS_FCNS_Module as udas
+    import udas_serial
+    import udas_logger
+    import udas_parsers
+    import udas_scheduler
+    import udas_gps
+
+    # Create CSV File with proper headers
+    # The file stays open and rows are written in batches (see udas_logger.py). A new file is started every hour.
+    log = udas_logger.UDASLogWriter('UDAS/UDAS_', ['Time (UTC)','Time (PST)','Latitude','Longitude','TempC','Conductivity', 'Salinity','Nitrate (uM)','Nitrogen (mg/L)','Chl_a','Turbidity','Transmission'],
+                                    flush_rows=30, flush_interval=10, fsync='flush', rotate_hourly=True)
+
+    #=================================================================================
+    #Seperate GPS variables defined
+    gps_port = '/dev/ttyS0'
+    ser = serial.Serial(gps_port, baudrate=9600, timeout=1)
+    sio = io.TextIOWrapper(io.BufferedRWPair(ser, ser))
+    # Turn on the basic GGA (the 4th digit after 'PMTK314' is a 1, denoting that GGA is 'on'. The 2nd digit would enable RMC if desired.)
+    ser.write(udas_gps.nmea_command('PMTK314,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0').encode())
+    # Set update rate to once a second (1hz) which is what you typically want.
+    ser.write(udas_gps.nmea_command('PMTK220,1000').encode())
+    #===================================================================================
+    nsample = 5        # number of light frames averaged together - should be greater than 4 (SUNA).
+
+    #Sensor ports are opened once and kept open. A sensor that drops off USB is reopened automatically (see udas_serial.py).
+    ports = udas_serial.SerialManager()
+    TSGsensor = ports.add('TSG', '/dev/ttyUSB2', 38400, timeout=5)
+    SUNA_sensor = ports.add('SUNA', '/dev/ttyUSB3', 57600, timeout=10)
+    TMsensor = ports.add('TM', '/dev/ttyUSB0', 19200, timeout=1)
+    chla_sensor = ports.add('chla', '/dev/ttyUSB1', 9600, timeout=1, rtscts=1)
+
+    #Each sensor is read on its own fixed deadlines (see udas_scheduler.py) and a row with the newest values is
+    #written every ROW_INTERVAL seconds, so rows stay evenly spaced however long a read takes.
+    ROW_INTERVAL = 3
+    SENSOR_RATES = {'TSG': 1, 'SUNA': 30, 'TM': 1, 'chla': 1, 'gps': 1}   #seconds between reads
+    latest = {'TSG': ('nan','nan','nan'), 'SUNA': ('NA','NA'), 'TM': 'nan', 'chla': ('nan','nan'), 'gps': ('nan','nan')}
+
+    def read_sensor(name, fcn, *args):
+        latest[name] = fcn(*args)
+
+    def write_row():
+        Temp,Conductivity,Salinity = latest['TSG']
+        nitrate_uM,nitrogen = latest['SUNA']
+        Beam_Attenuation = latest['TM']
+        chl_a,turb = latest['chla']
+        lat,lon = latest['gps']
+
+        ##Adds data to CSV file
+        time_now = datetime.now()
+        time_UTC = datetime.utcnow()
+        log.writerow([str(time_UTC), str(time_now),lat, lon, Temp,Conductivity, Salinity,nitrate_uM,nitrogen, chl_a, turb, Beam_Attenuation])
+
+        #Print everything
+        print(str(time_now),str(lat), str(lon), str(Temp), str(Conductivity), str(Salinity),
+              str(nitrate_uM), str(nitrogen), str(chl_a), str(turb), str(Beam_Attenuation))
+        print('------------------------------------------')
+        print()
+
+    def report_schedule():
+        #how late each task started (jitter) and how often it ran past its next deadline (overruns)
+        for name, report in scheduler.report().items():
+            print('{:5s} runs {:6d}  overruns {:4d}  jitter mean {} ms  max {} ms'.format(
+                name, report['runs'], report['overruns'], report['jitter_ms']['mean'], report['jitter_ms']['max']))
+
+    scheduler = udas_scheduler.Scheduler()
+    #read_newest empties the port and keeps the newest line, so the values are never older than one read
+    scheduler.add('TSG', read_sensor, ('TSG', udas.read_newest, TSGsensor, udas_parsers.TSG_SPEC), SENSOR_RATES['TSG'])
+    scheduler.add('TM', read_sensor, ('TM', udas.read_newest, TMsensor, udas_parsers.TM_SPEC), SENSOR_RATES['TM'])
+    scheduler.add('chla', read_sensor, ('chla', udas.read_newest, chla_sensor, udas_parsers.CHLA_SPEC), SENSOR_RATES['chla'])
+    scheduler.add('gps', read_sensor, ('gps', udas.get_gps, sio), SENSOR_RATES['gps'])
+    #Get Data from the SUNA Sensor (Nitrate); the polled cycle takes over 10 s and holds up the other reads while it runs
+    scheduler.add('SUNA', read_sensor, ('SUNA', udas.getSUNA, SUNA_sensor, nsample), SENSOR_RATES['SUNA'])
+    scheduler.add('row', write_row, (), ROW_INTERVAL, start=time.monotonic() + ROW_INTERVAL)
+    scheduler.add('report', report_schedule, (), 600, start=time.monotonic() + 600)
+    try:
+        scheduler.run()
+    finally:
+        report_schedule()
+        ports.close_all()
+        log.close()
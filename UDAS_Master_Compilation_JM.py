@@ -7,6 +7,9 @@ from datetime import datetime
 import time
 import csv
 import UDAS_FCNS_Module as udas
+import udas_serial
+import udas_parsers
+import udas_logger
 import board
 import busio
 import adafruit_gps
@@ -30,15 +33,20 @@ chl_port = '/dev/ttyUSB1' #USB port the Fluormeter is plugged into
 gps_port = '/dev/ttyS0'   #Plugged into serial port using wires. SHOULD NOT NEED TO BE CHANGED 
 #===================================================================================
 
-# Create CSV File with proper headers to store the data collected from the sensors
-file_time = datetime.now() #local time at which the porgram is started for data collection
-file_name = 'UDAS/UDAS_'+str(file_time)+'.csv' #file the data is stored if which can be found in the "UDAS" folder
-f = open(file_name,'w')
+#Open each sensor port once. The connections stay open for the whole run and reconnect on their own
+#if a USB sensor is unplugged and plugged back in (see udas_serial.py).
+ports = udas_serial.SerialManager()
+TSG_sensor = ports.add('TSG', TSG_port, 38400, timeout=5)
+SUNA_sensor = ports.add('SUNA', COM_SUNA, 57600, timeout=10)
+TM_sensor = ports.add('TM', TM_port, 19200, timeout=1)
+chla_sensor = ports.add('chla', chl_port, 9600, timeout=1, rtscts=1)
 
-#Define the headers
-header = csv.writer(f) 
-header.writerow(['Time (UTC)','Local_Time (PDT)','Latitude','Longitude','TempC','Conductivity', 'Salinity','Nitrate (uM)','Nitrogen (mg/L)','Chl_a','Turbidity','Transmission'])
-f.close()
+# Create CSV File with proper headers to store the data collected from the sensors
+#The file is named after the local time the program is started and can be found in the "UDAS" folder.
+#It stays open and rows are written in batches of flush_rows, or every flush_interval seconds (see udas_logger.py).
+#A new file is started every hour so a corrupted card only loses part of the cruise.
+log = udas_logger.UDASLogWriter('UDAS/UDAS_', ['Time (UTC)','Local_Time (PDT)','Latitude','Longitude','TempC','Conductivity', 'Salinity','Nitrate (uM)','Nitrogen (mg/L)','Chl_a','Turbidity','Transmission'],
+                                flush_rows=30, flush_interval=10, fsync='flush', rotate_hourly=True)
 
 #=================================================================================
 #Seperate GPS variables defined
@@ -55,37 +63,40 @@ gps.send_command(b"PMTK314,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0")
 gps.send_command(b"PMTK220,1000")
 #===================================================================================
 
-while True:
-#Read out the data from all the sensors then record it in a csv file (UDAS+start time) in the folder "UDAS"  
-    #Get data from TSG (Temp, conductivity, Salinity)
-    Temp,Conductivity,Salinity = udas.getTSG(TSG_port)
+#Ctrl-C stops the loop; the rows still in the buffer are written and the ports closed before the program exits
+try:
+    while True:
+    #Read out the data from all the sensors then record it in a csv file (UDAS+start time) in the folder "UDAS"  
+    #The TSG, transmissometer and fluorometer keep sending while the loop sleeps and waits for the SUNA, so read_newest
+    #empties each port and keeps only the newest line; a plain readline would log values that get older every cycle.
+        #Get data from TSG (Temp, conductivity, Salinity)
+        Temp,Conductivity,Salinity = udas.read_newest(TSG_sensor, udas_parsers.TSG_SPEC)
     
-    #Get Data from the SUNA Sensor (Nitrate)
-    nsample = 5        # number of light frames averaged together - should be greater than 4 (SUNA).
-    nitrate_uM,nitrogen = udas.getSUNA(COM_SUNA,nsample)
-    SUNA_sensor.close()
+        #Get Data from the SUNA Sensor (Nitrate)
+        nsample = 5        # number of light frames averaged together - should be greater than 4 (SUNA).
+        nitrate_uM,nitrogen = udas.getSUNA(SUNA_sensor,nsample)
     
-    #Get data from Transmissimeter (Beam attenuation)
-    Beam_Attenuation = udas.get_Transmissometer(TM_port)
+        #Get data from Transmissimeter (Beam attenuation)
+        Beam_Attenuation = udas.read_newest(TM_sensor, udas_parsers.TM_SPEC)
     
-    #Get Data from Fluorometer (Cholarphyl A and turbidity)
-    chl_a,turb = udas.get_chla(chla_port)
+        #Get Data from Fluorometer (Cholarphyl A and turbidity)
+        chl_a,turb = udas.read_newest(chla_sensor, udas_parsers.CHLA_SPEC)
     
-    #Get gps coordinates from gps
-    lat,lon = udas.get_gps(sio)
-#--------------------------------------------------------------------------------------    
-    #Add data to CSV file
-    f = open(file_name,'a')
-    writer = csv.writer(f)
-    time_now = datetime.now()
-    time_UTC = datetime.utcnow()
-    writer.writerow([str(time_UTC), str(time_now),lat, lon, Temp, Conductivity, Salinity, nitrate_uM, nitrogen, chl_a, turb, Beam_Attenuation])
-    time.sleep(3)  
-    f.close()
-#--------------------------------------------------------------------------------------
+        #Get gps coordinates from gps
+        lat,lon = udas.get_gps(sio)
+    #--------------------------------------------------------------------------------------    
+        #Add data to CSV file
+        time_now = datetime.now()
+        time_UTC = datetime.utcnow()
+        log.writerow([str(time_UTC), str(time_now),lat, lon, Temp, Conductivity, Salinity, nitrate_uM, nitrogen, chl_a, turb, Beam_Attenuation])
+        time.sleep(3)  
+    #--------------------------------------------------------------------------------------
     
-    #Print everything - used to test the code and make sure all are reading out
-    print(str(time_now),str(lat), str(lon), str(Temp), str(Conductivity), str(Salinity),
-          str(nitrate_uM), str(nitrogen), str(chl_a), str(turb), str(Beam_Attenuation))
-    print('---------------------------------------------------------------------------------------')
-    print()
\ No newline at end of file
+        #Print everything - used to test the code and make sure all are reading out
+        print(str(time_now),str(lat), str(lon), str(Temp), str(Conductivity), str(Salinity),
+              str(nitrate_uM), str(nitrogen), str(chl_a), str(turb), str(Beam_Attenuation))
+        print('---------------------------------------------------------------------------------------')
+        print()
+finally:
+    ports.close_all()
+    log.close()
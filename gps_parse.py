@@ -12,6 +12,7 @@ import io
 import pynmea2
 import serial
 import csv
+import udas_logger
 from datetime import datetime
 
 # Create a serial connection for the GPS connection using default speed and
@@ -24,12 +25,9 @@ from datetime import datetime
 ser = serial.Serial("/dev/ttyS0", baudrate=9600, timeout=10)
 sio = io.TextIOWrapper(io.BufferedRWPair(ser, ser))
 
-filename = str('gps'+str(datetime.now())+'.csv')
-file_init = open(filename,'w')
-writer = csv.writer(file_init)
+#Rows are buffered and written to the file every 30 fixes or 10 seconds (see udas_logger.py)
 header = ['Datetime (GMT)', 'Latitude', 'Longitude']
-writer.writerow(header)
-file_init.close()
+log = udas_logger.UDASLogWriter('gps', header, flush_rows=30, flush_interval=10)
 
 # If using I2C, we'll create an I2C interface to talk to using default pins
 # i2c = board.I2C()
@@ -64,36 +62,35 @@ gps.send_command(b"PMTK220,1000")
 
 # Main loop runs forever printing data as it comes in
 timestamp = time.monotonic()
-while True:
-    try:
-    #data = gps.read(32)  # read up to 32 bytes
-    # print(data)  # this is a bytearray type
-        line = sio.readline()
-        if line.startswith('$GPGGA'):
-            msg= pynmea2.parse(line)
-            print(repr(msg.timestamp), repr(msg.lat), repr(msg.lon))
-            f = open(filename,'a')
-            writer = csv.writer(f)
-            writer.writerow([repr(msg.timestamp), repr(msg.lat), repr(msg.lon)])
-            f.close()
-    except serial.SerialException as e:
-        print('Device error: {}'.format(e))
-        break
-    except pynmea2.ParseError as e:
-        print('Parse error: {}'.format(e))
-    except AttributeError as e:
-        print('Attribute error: {}'.format(e))
-        continue
-
-    #if line is not None:
-        # convert bytearray to string
-        #all "line" variables were previously called "data"
-        #data_string = "".join([chr(b) for b in line])
-        #print(data_string, end="")
-
-    #if time.monotonic() - timestamp > 5:
-        # every 5 seconds...
-        #gps.send_command(b"PMTK605")  # request firmware version
-        #timestamp = time.monotonic()
+#Ctrl-C stops the loop; the fixes still in the buffer are written before the program exits
+try:
+    while True:
+        try:
+        #data = gps.read(32)  # read up to 32 bytes
+        # print(data)  # this is a bytearray type
+            line = sio.readline()
+            if line.startswith('$GPGGA'):
+                msg= pynmea2.parse(line)
+                print(repr(msg.timestamp), repr(msg.lat), repr(msg.lon))
+                log.writerow([repr(msg.timestamp), repr(msg.lat), repr(msg.lon)])
+        except serial.SerialException as e:
+            print('Device error: {}'.format(e))
+            break
+        except pynmea2.ParseError as e:
+            print('Parse error: {}'.format(e))
+        except AttributeError as e:
+            print('Attribute error: {}'.format(e))
+            continue
 
+        #if line is not None:
+            # convert bytearray to string
+            #all "line" variables were previously called "data"
+            #data_string = "".join([chr(b) for b in line])
+            #print(data_string, end="")
 
+        #if time.monotonic() - timestamp > 5:
+            # every 5 seconds...
+            #gps.send_command(b"PMTK605")  # request firmware version
+            #timestamp = time.monotonic()
+finally:
+    log.close()
@@ -1,37 +1,31 @@
 from datetime import datetime
 import time as t
-import csv
-import serial
+import UDAS_FCNS_Module as udas
+import udas_serial
+import udas_parsers
+import udas_logger
 
 port = '/dev/ttyUSB0'
 baud = 38400 #bits per second (rate of information/second)
 time = datetime.now()
-sensor = serial.Serial(port, baud, timeout=1) #waits 1 second between measurements
+sensor = udas_serial.SerialConnection(port, baud, timeout=1) #waits 1 second between measurements. Stays open for the whole run.
 
 
 
-f = open('TSG_UDAS.csv','w')
-header = csv.writer(f)
-header.writerow(['Time (PST)','TempC','Conductivity', 'Salinity'])
-f.close()
+#Rows are buffered and written to the file every 30 samples or 10 seconds (see udas_logger.py)
+log = udas_logger.UDASLogWriter('TSG_UDAS_', ['Time (PST)','TempC','Conductivity', 'Salinity'], flush_rows=30, flush_interval=10)
 
-while True:
-    f = open('TSG_UDAS.csv','a')
+#Ctrl-C stops the loop; the rows still in the buffer are written before the program exits
+try:
+    while True:
+        #read everything that queued up during the sleep and keep the newest line, so the value is never stale
+        data_T,data_C,data_S = udas.read_newest(sensor, udas_parsers.TSG_SPEC)
     
-    with serial.Serial(port, baud, timeout=1) as sensor:
-        data = sensor.readline().decode()
-        split = data.split(',')
-        #data_T = split[0].replace(',','')
-        #data_C = split[1].replace(',','')
-        #data_S = split[2].replace(',','')
-        
         #print(time, data_T,data_C,data_S)
 
-    writer = csv.writer(f)
-    writer.writerow([str(time),float(split[0]),float(split[1]),float(split[2])])
+        log.writerow([str(time),data_T,data_C,data_S])
     
-    t.sleep(1)
-    time = datetime.now()
-    
-    f.close()
-
+        t.sleep(1)
+        time = datetime.now()
+finally:
+    log.close()
@@ -0,0 +1,217 @@
+##UDAS Acquisition Benchmark
+#Times the acquisition path against simulated (or replayed) serial streams from udas_simulator.py:
+#   read   - latency of each sensor function on a live virtual port
+#   parse  - cost of the sensor functions on lines already in memory (no waiting for the port)
+#   write  - cost per row of the CSV and columnar log writers
+#   loop   - time of one full acquisition loop and the rows per second it achieves
+#Results are written as JSON so runs before and after a change can be compared.
+#
+#Run from the terminal:  python udas_benchmark.py --speedup 50 --output bench.json
+
+import io
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+from datetime import datetime
+import numpy as np
+import serial
+
+import UDAS_FCNS_Module as udas
+import udas_serial
+import udas_logger
+import udas_columns
+import udas_suna
+import udas_gps
+import udas_simulator
+import udas_parsers
+
+
+#========================================================================================
+def summarize(times):
+    '''Latency statistics in milliseconds for a list of durations in seconds.'''
+    if len(times) == 0:
+        return {'n': 0}
+    ms = np.asarray(times) * 1000.0
+    return {'n': int(ms.size),
+            'mean_ms': float(ms.mean()),
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p90_ms': float(np.percentile(ms, 90)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'max_ms': float(ms.max())}
+
+
+def time_calls(fcn, args=(), n=100):
+    '''Call fcn(*args) n times and return the duration of each call.'''
+    times = []
+    for i in range(n):
+        start = time.perf_counter()
+        fcn(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+#========================================================================================
+def bench_read(sims, n=50):
+    '''Latency of each sensor function reading from its virtual port.'''
+    ports = udas_serial.SerialManager()
+    ports.add('TSG', sims['TSG'].port, 38400, timeout=5)
+    ports.add('TM', sims['TM'].port, 19200, timeout=1)
+    ports.add('chla', sims['chla'].port, 9600, timeout=1)
+    #same GPS set up as the master compilation script
+    gps_ser = serial.Serial(sims['gps'].port, baudrate=9600, timeout=1)
+    sio = io.TextIOWrapper(io.BufferedRWPair(gps_ser, gps_ser))
+    results = {'getTSG': summarize(time_calls(udas.getTSG, (ports['TSG'],), n)),
+               'get_Transmissometer': summarize(time_calls(udas.get_Transmissometer, (ports['TM'],), n)),
+               'get_chla': summarize(time_calls(udas.get_chla, (ports['chla'],), n)),
+               'get_gps': summarize(time_calls(udas.get_gps, (sio,), n))}
+    ports.close_all()
+    gps_ser.close()
+    return results
+
+
+def bench_suna_poll(sims, n=1, nsample=5):
+    '''Latency of the polled getSUNA cycle (includes its 10 s wait, so keep n small).'''
+    suna = udas_serial.SerialConnection(sims['SUNA'].port, 57600, timeout=10)
+    result = summarize(time_calls(udas.getSUNA, (suna, nsample), n))
+    suna.close()
+    return result
+
+
+def bench_parse(sims, n=2000):
+    '''Cost of the sensor functions on in-memory lines, i.e. the parsing alone.'''
+    rng = sims['TSG'].rng
+    tsg = io.BytesIO(''.join(udas_simulator.tsg_line(rng, i) for i in range(n)).encode())
+    tm = io.BytesIO(''.join(udas_simulator.transmissometer_line(rng, i) for i in range(n)).encode())
+    chla = io.BytesIO(''.join(udas_simulator.fluorometer_line(rng, i) for i in range(n)).encode())
+    gga = io.StringIO(''.join(udas_simulator.gps_lines(rng, i).split('\r\n')[0] + '\r\n' for i in range(n)))
+    suna_lines = [udas_simulator.suna_frame(rng, i).encode() for i in range(n)]
+    suna_stream = udas_suna.SUNAStream(None)
+    gps_reader = udas_gps.GPSReader(None)
+    nmea = [line.encode() for i in range(n // 2) for line in udas_simulator.gps_lines(rng, i).split('\r\n')[:2]]
+    results = {'getTSG': summarize(time_calls(udas.getTSG, (tsg,), n)),
+               'get_Transmissometer': summarize(time_calls(udas.get_Transmissometer, (tm,), n)),
+               'get_chla': summarize(time_calls(udas.get_chla, (chla,), n)),
+               'get_gps': summarize(time_calls(udas.get_gps, (gga,), n))}
+    times = []
+    for line in suna_lines:
+        start = time.perf_counter()
+        suna_stream.add_line(line, time.time())
+        times.append(time.perf_counter() - start)
+    results['SUNAStream.add_line'] = summarize(times)
+    times = []
+    for line in nmea:
+        start = time.perf_counter()
+        gps_reader.add_line(line, time.monotonic())
+        times.append(time.perf_counter() - start)
+    results['GPSReader.add_line'] = summarize(times)
+    #batch parsers: one call for all n lines, reported per line
+    for name, raw in (('TSG', tsg), ('TM', tm), ('chla', chla)):
+        lines = raw.getvalue().split(b'\n')
+        start = time.perf_counter()
+        udas_parsers.parse_lines(udas_parsers.SPECS[name], lines)
+        results['parse_lines.' + name] = {'n': len(lines), 'per_line_us': (time.perf_counter() - start) / len(lines) * 1e6}
+    return results
+
+
+def bench_write(n=5000):
+    '''Cost per row of the CSV log writer (buffered and fsync per row) and the columnar writer.'''
+    folder = tempfile.mkdtemp(prefix='udas_bench_')
+    row = [str(datetime.utcnow()), str(datetime.now()), 36.81, -121.78, 12.5, 4.1, 33.5, 15.2, 0.21, 60, 120, 0.45]
+    values = [time.time()] + row[2:]
+    results = {}
+    try:
+        for label, kwargs in (('csv_buffered', {'flush_rows': 60, 'fsync': 'flush'}),
+                              ('csv_fsync_every_row', {'flush_rows': 1, 'fsync': 'flush'})):
+            log = udas_logger.UDASLogWriter(os.path.join(folder, label + '_'), ['h'] * len(row), **kwargs)
+            rows = n if kwargs['flush_rows'] > 1 else min(n, 200)
+            times = time_calls(log.writerow, (row,), rows)
+            log.close()
+            results[label] = summarize(times)
+        log = udas_columns.UDASColumnWriter(os.path.join(folder, 'columns'))
+        times = time_calls(log.writerow, (values,), n)
+        log.close()
+        results['columns'] = summarize(times)
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+
+def bench_loop(sims, duration=10.0):
+    '''Run the sequential acquisition loop (no sleep, SUNA and GPS from their background readers) for
+        duration seconds and report loop time and achieved rows per second.'''
+    folder = tempfile.mkdtemp(prefix='udas_bench_')
+    ports = udas_serial.SerialManager()
+    TSGsensor = ports.add('TSG', sims['TSG'].port, 38400, timeout=5)
+    TMsensor = ports.add('TM', sims['TM'].port, 19200, timeout=1)
+    chla_sensor = ports.add('chla', sims['chla'].port, 9600, timeout=1)
+    suna_stream = udas_suna.SUNAStream(ports.add('SUNA', sims['SUNA'].port, 57600, timeout=1), window=30)
+    suna_stream.start()
+    gps_reader = udas_gps.GPSReader(ports.add('gps', sims['gps'].port, 9600, timeout=1))
+    gps_reader.start()
+    log = udas_logger.UDASLogWriter(os.path.join(folder, 'UDAS_'), ['h'] * 12)
+    times = []
+    try:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            start = time.perf_counter()
+            Temp,Conductivity,Salinity = udas.getTSG(TSGsensor)
+            nitrate_uM,nitrogen = suna_stream.read()
+            Beam_Attenuation = udas.get_Transmissometer(TMsensor)
+            chl_a,turb = udas.get_chla(chla_sensor)
+            lat,lon = gps_reader.read()
+            log.writerow([str(datetime.utcnow()), str(datetime.now()),lat, lon, Temp,Conductivity, Salinity,nitrate_uM,nitrogen, chl_a, turb, Beam_Attenuation])
+            times.append(time.perf_counter() - start)
+    finally:
+        log.close()
+        suna_stream.stop()
+        gps_reader.stop()
+        ports.close_all()
+        shutil.rmtree(folder)
+    result = summarize(times)
+    result['rows_per_s'] = len(times) / duration
+    return result
+
+
+#========================================================================================
+def run_benchmarks(speedup=50.0, n_read=50, n_parse=2000, n_write=5000, loop_seconds=10.0, suna_poll=False,
+                   seed=1, recordings=None):
+    '''Run every benchmark and return the results as a dictionary (see the top of this file).'''
+    sims = udas_simulator.start_simulators(speedup=speedup, seed=seed, recordings=recordings)
+    try:
+        results = {'time': datetime.utcnow().isoformat(),
+                   'host': platform.node(),
+                   'python': platform.python_version(),
+                   'speedup': speedup,
+                   'read': bench_read(sims, n_read),
+                   'parse': bench_parse(sims, n_parse),
+                   'write': bench_write(n_write),
+                   'loop': bench_loop(sims, loop_seconds)}
+        if suna_poll:
+            results['read']['getSUNA'] = bench_suna_poll(sims)
+        results['simulator'] = dict((name, {'sent': sim.lines_sent, 'overruns': sim.overruns}) for name, sim in sims.items())
+    finally:
+        udas_simulator.stop_simulators(sims)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the UDAS acquisition path against simulated sensors')
+    parser.add_argument('--speedup', type=float, default=50.0, help='simulated sensor rate relative to real time')
+    parser.add_argument('--loop-seconds', type=float, default=10.0, help='length of the end-to-end loop run')
+    parser.add_argument('--suna-poll', action='store_true', help='also time one polled getSUNA cycle (over 10 s)')
+    parser.add_argument('--record', action='append', default=[], metavar='NAME=FILE',
+                        help='replay a recorded raw stream for a sensor (TSG, TM, chla or gps)')
+    parser.add_argument('--output', help='write the JSON results to this file as well as the screen')
+    args = parser.parse_args()
+
+    recordings = dict(item.split('=', 1) for item in args.record)
+    results = run_benchmarks(args.speedup, loop_seconds=args.loop_seconds, suna_poll=args.suna_poll, recordings=recordings)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
@@ -0,0 +1,209 @@
+##UDAS Columnar Log
+#Binary alternative to the UDAS CSV log. Every channel is stored as its own file of fixed-type values
+#(float64 epoch time, float64 position, float32 measurements) with NaN for missing data, so a whole cruise
+#can be memory-mapped back in without parsing text.
+#
+#A log is a folder:
+#   meta.json        - column names, NumPy dtypes and the CSV header each column came from
+#   <column>.bin     - the raw values of one column, appended in chunks
+
+import os
+import csv
+import json
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+
+# (column, dtype, CSV header) for the merged UDAS log written by UDAS_Master_Compilation.py
+UDAS_COLUMNS = [('time', 'f8', 'Time (UTC)'),
+                ('lat', 'f8', 'Latitude'),
+                ('lon', 'f8', 'Longitude'),
+                ('temp', 'f4', 'TempC'),
+                ('conductivity', 'f4', 'Conductivity'),
+                ('salinity', 'f4', 'Salinity'),
+                ('nitrate', 'f4', 'Nitrate (uM)'),
+                ('nitrogen', 'f4', 'Nitrogen (mg/L)'),
+                ('chl_a', 'f4', 'Chl_a'),
+                ('turbidity', 'f4', 'Turbidity'),
+                ('transmission', 'f4', 'Transmission')]
+
+
+#========================================================================================
+def to_float(value):
+    '''Sensor value to float. 'nan', 'NA', '' and anything else that is not a number become NaN.
+        Quotes left by repr() (e.g. the GPS strings of old logs) are stripped first.'''
+    try:
+        return float(str(value).strip().strip("'\""))
+    except ValueError:
+        return float('nan')
+
+
+def nmea_to_degrees(value, hemisphere, limit):
+    '''Position of an old CSV log to signed decimal degrees.
+
+        Logs written before get_gps returned decimal degrees hold the NMEA ddmm.mmmm (dddmm.mmmm) string as
+        repr() text, e.g. "'3648.6540'", without the hemisphere. Those (quoted, or beyond limit degrees) are
+        converted and made negative for an 'S' or 'W' hemisphere; decimal degrees are returned unchanged.
+        '''
+    text = str(value).strip()
+    x = to_float(text)
+    if np.isnan(x) or not (text[:1] in '\'"' or abs(x) > limit):
+        return x
+    degrees = np.floor(x / 100)
+    x = degrees + (x - 100 * degrees) / 60
+    return -x if hemisphere in ('S', 'W') else x
+
+
+def to_epoch(value):
+    '''UTC time as a str(datetime), datetime or number to seconds since 1970-01-01 UTC. Unreadable times become NaN.'''
+    if isinstance(value, datetime):
+        t = value
+    else:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+        try:
+            t = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            return float('nan')
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+
+#========================================================================================
+class UDASColumnWriter:
+    '''Append rows to a columnar UDAS log.
+
+        INPUTS:
+           path - folder the log is written to (created if needed)
+           columns - list of (name, dtype, CSV header) tuples, UDAS_COLUMNS by default
+           chunk_rows - rows held in memory before they are appended to the column files
+           flush_interval - or seconds after which a partly filled chunk is written anyway
+           fsync - fsync the column files after every chunk
+
+        Rows are given in column order, times as epoch seconds (or datetime / str(datetime) in UTC):
+           log = UDASColumnWriter('UDAS/UDAS_'+str(datetime.now()))
+           log.writerow([time.time(), lat, lon, Temp, Conductivity, Salinity, nitrate_uM, nitrogen, chl_a, turb, Beam_Attenuation])
+        '''
+    def __init__(self, path, columns=UDAS_COLUMNS, chunk_rows=600, flush_interval=10.0, fsync=True):
+        self.path = path
+        self.columns = [tuple(c) for c in columns]
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'columns': [list(c) for c in self.columns], 'created': datetime.now(timezone.utc).isoformat()}, f)
+        self.buffers = [np.empty(chunk_rows, dtype=np.dtype(dtype)) for name, dtype, header in self.columns]
+        self.files = [open(os.path.join(path, name + '.bin'), 'ab') for name, dtype, header in self.columns]
+        self.n = 0
+        self.first_buffered = None
+        self.rows = 0
+
+    def writerow(self, row):
+        if self.n == 0:
+            self.first_buffered = time.monotonic()
+        for i, value in enumerate(row):
+            if i == 0:
+                self.buffers[i][self.n] = to_epoch(value)
+            else:
+                self.buffers[i][self.n] = to_float(value)
+        self.n = self.n + 1
+        if self.n >= self.chunk_rows or time.monotonic() - self.first_buffered >= self.flush_interval:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def poll(self):
+        '''Write a partly filled chunk once it is older than flush_interval.'''
+        if self.n and time.monotonic() - self.first_buffered >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''Append the buffered rows to every column file.'''
+        if self.n == 0:
+            return
+        for buf, f in zip(self.buffers, self.files):
+            f.write(buf[:self.n].tobytes())
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.rows = self.rows + self.n
+        self.n = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#========================================================================================
+def read_udas_columns(path):
+    '''Open a columnar UDAS log without reading it into memory.
+
+        INPUTS:
+           path - folder written by UDASColumnWriter or csv_to_columns
+
+        RETURNS:
+        dictionary {column name: read-only numpy.memmap}. All columns have the same length; rows only partly
+        written when the logger was stopped (e.g. a power cut) are left out.
+        Use pd.DataFrame(read_udas_columns(path)) for a DataFrame.
+        '''
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    sizes = []
+    for name, dtype, header in meta['columns']:
+        sizes.append(os.path.getsize(os.path.join(path, name + '.bin')) // np.dtype(dtype).itemsize)
+    n = min(sizes) if sizes else 0
+    data = {}
+    for name, dtype, header in meta['columns']:
+        if n == 0:
+            data[name] = np.empty(0, dtype=dtype)
+        else:
+            data[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=(n,))
+    return data
+
+
+def csv_to_columns(csv_file, path, columns=UDAS_COLUMNS, chunk_rows=10000, hemispheres=('N', 'W')):
+    '''Convert an existing UDAS CSV log to the columnar format.
+
+        INPUTS:
+           csv_file - UDAS CSV written by one of the master compilation scripts
+           path - output folder
+           columns - (name, dtype, CSV header) tuples; each header is looked up in the CSV header row
+                     ('Time (UTC)' is converted to epoch seconds, columns missing from the CSV are NaN)
+           hemispheres - hemisphere of the 'lat' and 'lon' columns, used to sign old NMEA ddmm.mmmm positions
+                         (see nmea_to_degrees; the CSV logs do not record it)
+
+        RETURNS:
+        number of rows converted
+        '''
+    with open(csv_file, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        index = [header.index(h) if h in header else None for name, dtype, h in columns]
+        names = [name for name, dtype, h in columns]
+        position = dict((names.index(name), (hemisphere, limit)) for name, hemisphere, limit
+                        in (('lat', hemispheres[0], 90), ('lon', hemispheres[1], 180)) if name in names)
+        with UDASColumnWriter(path, columns, chunk_rows=chunk_rows, flush_interval=float('inf'), fsync=False) as log:
+            for line in reader:
+                if not line:
+                    continue
+                row = [line[i] if i is not None and i < len(line) else 'nan' for i in index]
+                for k, (hemisphere, limit) in position.items():
+                    row[k] = nmea_to_degrees(row[k], hemisphere, limit)
+                log.writerow(row)
+            log.flush()
+            rows = log.rows
+    return rows
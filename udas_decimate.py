@@ -0,0 +1,169 @@
+##UDAS Decimation Tiers
+#Block statistics (mean, min, max, std, count) of every UDAS channel at several resolutions, e.g. 1 s, 1 min
+#and 10 min, each written to its own columnar log (see udas_columns.py). A quick look at a whole cruise then
+#reads a few thousand 10 min rows instead of millions of raw rows.
+#
+#Only the finest tier sees the rows; each coarser tier is built by merging the finished blocks of the tier
+#below it, so the cost per row does not grow with the number of tiers. std is the population standard
+#deviation (ddof=0, like np.std) and NaN values are left out of every statistic.
+
+from datetime import datetime
+import numpy as np
+
+import udas_columns
+
+
+STATS = ('mean', 'min', 'max', 'std', 'count')
+
+
+def tier_label(seconds):
+    '''Short name of a tier length: 1 -> '1s', 60 -> '1min', 600 -> '10min', 3600 -> '1h'.'''
+    if seconds % 3600 == 0:
+        return '{:g}h'.format(seconds / 3600)
+    if seconds % 60 == 0:
+        return '{:g}min'.format(seconds / 60)
+    return '{:g}s'.format(seconds)
+
+
+def tier_columns(fields):
+    '''(column, dtype, header) list of a tier log for the given channel names.'''
+    columns = [('time', 'f8', 'Block start (UTC)')]
+    for field in fields:
+        for stat in STATS:
+            columns.append((field + '_' + stat, 'u4' if stat == 'count' else 'f4', field + ' ' + stat))
+    return columns
+
+
+#========================================================================================
+class BlockStats:
+    '''Running count, mean, sum of squared deviations (m2), min and max of a set of channels.'''
+    def __init__(self, n):
+        self.n = n
+        self.reset(None)
+
+    def reset(self, start):
+        self.start = start
+        self.count = np.zeros(self.n, dtype=np.int64)
+        self.mean = np.zeros(self.n)
+        self.m2 = np.zeros(self.n)
+        self.min = np.full(self.n, np.inf)
+        self.max = np.full(self.n, -np.inf)
+
+    def add(self, x):
+        '''Add one row of values (NaN for missing) with Welford's update.'''
+        good = ~np.isnan(x)
+        x = np.where(good, x, 0.0)
+        self.count = self.count + good
+        delta = np.where(good, x - self.mean, 0.0)
+        self.mean = self.mean + delta / np.maximum(self.count, 1)
+        self.m2 = self.m2 + np.where(good, delta * (x - self.mean), 0.0)
+        self.min = np.where(good, np.minimum(self.min, x), self.min)
+        self.max = np.where(good, np.maximum(self.max, x), self.max)
+
+    def merge(self, other):
+        '''Combine the statistics of another block (Chan's parallel update).'''
+        count = self.count + other.count
+        n = np.maximum(count, 1)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / n
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / n
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    def row(self):
+        '''[start, mean, min, max, std, count of the 1st channel, ... of the 2nd channel, ...]'''
+        empty = self.count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / self.count)
+        stats = np.stack([np.where(empty, np.nan, self.mean),
+                          np.where(empty, np.nan, self.min),
+                          np.where(empty, np.nan, self.max),
+                          np.where(empty, np.nan, std),
+                          self.count], axis=1)
+        return [self.start] + stats.ravel().tolist()
+
+
+#========================================================================================
+class Decimator:
+    '''Streaming block statistics at several tiers.
+
+        INPUTS:
+           fields - names of the channels in every row
+           tiers - block lengths in seconds, finest first; each must be a whole multiple of the one before
+           writers - one object with a writerow() method per tier (e.g. from open_tiers), None to only keep rows in memory
+
+        A block is written when the first row of a later block arrives (or on flush()).
+
+        EXAMPLE:
+           decimator = Decimator(['temp','salinity'], tiers=(1, 60, 600), writers=open_tiers('UDAS/UDAS_', ['temp','salinity']))
+           decimator.add(time.time(), [12.1, 33.5])
+           ...
+           decimator.close()
+        '''
+    def __init__(self, fields, tiers=(1, 60, 600), writers=None):
+        self.fields = list(fields)
+        self.tiers = [float(t) for t in tiers]
+        for fine, coarse in zip(self.tiers, self.tiers[1:]):
+            ratio = coarse / fine
+            if coarse <= fine or abs(ratio - round(ratio)) > 1e-9:
+                raise ValueError('Each tier must be a whole multiple of the one before it: {}'.format(tiers))
+        self.writers = writers
+        self.blocks = [BlockStats(len(self.fields)) for t in self.tiers]
+        self.rows = [[] for t in self.tiers] if writers is None else None
+
+    def add(self, timestamp, values):
+        '''Add one row (values in the order of fields, numbers or 'nan' strings).'''
+        x = np.array([udas_columns.to_float(v) for v in values])
+        start = np.floor(timestamp / self.tiers[0]) * self.tiers[0]
+        block = self.blocks[0]
+        if block.start is not None and start != block.start:
+            self.close_block(0)
+        if block.start is None:
+            block.start = start
+        block.add(x)
+
+    def close_block(self, level):
+        #write the block of this tier, merge it into the next tier and start an empty one
+        block = self.blocks[level]
+        self.write(level, block.row())
+        if level + 1 < len(self.tiers):
+            tier = self.tiers[level + 1]
+            start = np.floor(block.start / tier) * tier
+            upper = self.blocks[level + 1]
+            if upper.start is not None and start != upper.start:
+                self.close_block(level + 1)
+            if upper.start is None:
+                upper.start = start
+            upper.merge(block)
+        block.reset(None)
+
+    def write(self, level, row):
+        if self.writers is None:
+            self.rows[level].append(row)
+        else:
+            self.writers[level].writerow(row)
+
+    def flush(self):
+        '''Write every partly filled block (e.g. at the end of a run).'''
+        for level in range(len(self.tiers)):
+            if self.blocks[level].start is not None:
+                self.close_block(level)
+
+    def poll(self):
+        if self.writers is not None:
+            for writer in self.writers:
+                writer.poll()
+
+    def close(self):
+        self.flush()
+        if self.writers is not None:
+            for writer in self.writers:
+                writer.close()
+
+
+def open_tiers(prefix, fields, tiers=(1, 60, 600)):
+    '''One UDASColumnWriter per tier, in folders called prefix + time + '_' + tier_label(tier).'''
+    name = prefix + str(datetime.now())
+    return [udas_columns.UDASColumnWriter(name + '_' + tier_label(tier), tier_columns(fields),
+                                          chunk_rows=max(1, int(600 // tier))) for tier in tiers]
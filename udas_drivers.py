@@ -0,0 +1,33 @@
+##UDAS Serial Line Drivers
+#Drivers for udas_registry.py that read with the functions in UDAS_FCNS_Module.
+
+import UDAS_FCNS_Module as udas
+import udas_parsers
+from udas_registry import Sensor, open_port
+
+
+#========================================================================================
+def line_sensor(name, conf, ports):
+    '''Instrument that sends one ASCII line per sample, parsed with a udas_parsers LineSpec.
+
+        CONFIGURATION:
+           parser - name of the LineSpec in udas_parsers.SPECS ('TSG', 'TM', 'chla'), the sensor name by default
+           port, baudrate, timeout, options - serial port settings (options are passed on to serial.Serial)
+
+        Every line waiting on the port is read (udas.read_all), so no sample is skipped.
+        '''
+    spec = udas_parsers.SPECS[conf.get('parser', name)]
+    conn = open_port(name, conf, ports)
+    return Sensor(name, udas.read_all, [field for field, index in spec.fields], args=(conn, spec), batch=True,
+                  conn=conn, counters={'parse_errors': lambda: udas.malformed_lines.get(spec.name, 0)})
+
+
+def suna_poll_sensor(name, conf, ports):
+    '''SUNA woken up for every reading with getSUNA (over 10 s per reading).
+
+        CONFIGURATION:
+           nsample - number of light frames averaged together, should be greater than 4
+        '''
+    conn = open_port(name, conf, ports)
+    return Sensor(name, udas.getSUNA, ['nitrate', 'nitrogen'], args=(conn, conf.get('nsample', 5)),
+                  method='asof', missing=('NA', 'NA'), conn=conn)
@@ -0,0 +1,161 @@
+##UDAS Sensor Fusion
+#Lines up the timestamped samples from each sensor on one common time grid so every row of the merged
+#log holds values that were measured at (nearly) the same time, even though the sensors run at different rates.
+
+import bisect
+import math
+import time
+
+
+#========================================================================================
+def to_float(value):
+    '''Convert a sensor value to float. The 'nan'/'NA' strings used by the sensor functions become NaN.'''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def interpolate(t, t0, v0, t1, v1):
+    '''Linear interpolation between two samples. Scalars or tuples of values are accepted.
+        Values that are not numbers fall back to the closer of the two samples.'''
+    if t1 == t0:
+        return v0
+    w = (t - t0) / (t1 - t0)
+    scalar = not isinstance(v0, (tuple, list))
+    a = (v0,) if scalar else v0
+    b = (v1,) if scalar else v1
+    out = []
+    for x0, x1 in zip(a, b):
+        f0 = to_float(x0)
+        f1 = to_float(x1)
+        if math.isnan(f0) or math.isnan(f1):
+            out.append(x0 if w < 0.5 else x1)
+        else:
+            out.append(f0 + w * (f1 - f0))
+    return out[0] if scalar else tuple(out)
+
+
+#========================================================================================
+class SensorStream:
+    '''Time ordered samples from one sensor and the rule used to read them at a grid time.
+
+        INPUTS:
+           method - 'nearest' : closest sample to the grid time
+                    'linear'  : interpolate between the samples either side of the grid time
+                    'asof'    : last sample at or before the grid time
+           tolerance - a sample further than this many seconds from the grid time is not used
+           missing - value returned when no sample is close enough (e.g. ('nan','nan') for a two value sensor)
+        '''
+    def __init__(self, method='nearest', tolerance=1.0, missing='nan'):
+        if method not in ('nearest', 'linear', 'asof'):
+            raise ValueError("method must be 'nearest', 'linear' or 'asof'")
+        self.method = method
+        self.tolerance = tolerance
+        self.missing = missing
+        self.times = []
+        self.values = []
+
+    def add(self, timestamp, values):
+        if self.times and timestamp < self.times[-1]:
+            #Out of order sample, keep the list sorted
+            i = bisect.bisect_right(self.times, timestamp)
+            self.times.insert(i, timestamp)
+            self.values.insert(i, values)
+        else:
+            self.times.append(timestamp)
+            self.values.append(values)
+
+    def latest_time(self):
+        return self.times[-1] if self.times else None
+
+    def value_at(self, t):
+        '''Value of this sensor at grid time t according to method and tolerance.'''
+        i = bisect.bisect_right(self.times, t)
+        before = i - 1 if i > 0 and t - self.times[i - 1] <= self.tolerance else None
+        after = i if i < len(self.times) and self.times[i] - t <= self.tolerance else None
+        if self.method == 'asof':
+            return self.values[before] if before is not None else self.missing
+        if self.method == 'nearest':
+            if before is None and after is None:
+                return self.missing
+            if after is None:
+                return self.values[before]
+            if before is None or self.times[after] - t < t - self.times[before]:
+                return self.values[after]
+            return self.values[before]
+        #linear
+        if before is not None and self.times[before] == t:
+            return self.values[before]
+        if before is None or after is None:
+            return self.missing
+        return interpolate(t, self.times[before], self.values[before], self.times[after], self.values[after])
+
+    def discard_before(self, t):
+        '''Drop samples that can no longer be used for grid times after t (keeps the last one at or before t).'''
+        i = bisect.bisect_right(self.times, t) - 1
+        if i > 0:
+            del self.times[:i]
+            del self.values[:i]
+
+
+#========================================================================================
+class SensorFusion:
+    '''Incrementally resample several timestamped sensor streams onto a common time grid.
+
+        INPUTS:
+           interval - spacing of the output grid in seconds
+           max_lag - a grid time is written once every sensor has a sample at or after it, or once it is
+                     this many seconds old (slow or dead sensors then get their nearest/asof value or 'missing')
+
+        EXAMPLE:
+           fusion = SensorFusion(interval=1)
+           fusion.add_sensor('TSG', method='linear', tolerance=2, missing=('nan','nan','nan'))
+           fusion.add_sensor('SUNA', method='asof', tolerance=60, missing=('NA','NA'))
+           fusion.add('TSG', time.time(), (12.1, 4.2, 33.5))
+           for grid_time, record in fusion.pop_records():
+               Temp,Conductivity,Salinity = record['TSG']
+        '''
+    def __init__(self, interval=1.0, max_lag=5.0):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.streams = {}
+        self.next_time = None
+
+    def add_sensor(self, name, method='nearest', tolerance=None, missing='nan'):
+        if tolerance is None:
+            tolerance = self.interval
+        self.streams[name] = SensorStream(method, tolerance, missing)
+        return self.streams[name]
+
+    def add(self, name, timestamp, values):
+        '''Add one sample. Samples from sensors that were not registered with add_sensor are ignored.'''
+        if name not in self.streams:
+            return
+        self.streams[name].add(timestamp, values)
+        if self.next_time is None:
+            self.next_time = math.ceil(timestamp / self.interval) * self.interval
+
+    def is_ready(self, t, now):
+        if now - t >= self.max_lag:
+            return True
+        for stream in self.streams.values():
+            latest = stream.latest_time()
+            if latest is None or latest < t:
+                return False
+        return True
+
+    def pop_records(self, now=None):
+        '''Return every grid time that is ready as a list of (grid_time, {name: values}).'''
+        if now is None:
+            now = time.time()
+        records = []
+        if self.next_time is None:
+            return records
+        while self.next_time <= now and self.is_ready(self.next_time, now):
+            t = self.next_time
+            records.append((t, dict((name, stream.value_at(t)) for name, stream in self.streams.items())))
+            for stream in self.streams.values():
+                stream.discard_before(t)
+            self.next_time = t + self.interval
+        return records
@@ -0,0 +1,202 @@
+##UDAS GPS Reader
+#Reads the NMEA stream from the GPS continuously in a background thread so sentences never pile up in the
+#UART buffer, and keeps the most recent position fix ready for the acquisition loop.
+
+import threading
+import collections
+import time
+from datetime import datetime, date, timezone
+import serial
+import pynmea2
+
+import udas_logger
+from udas_registry import Sensor, open_port
+
+
+# One position fix: decimal degrees, UTC time of the fix, GGA fix quality (0 = no fix, 1 = GPS, 2 = DGPS ...),
+# number of satellites and the local time.monotonic() the sentence was received (used for the fix age)
+Fix = collections.namedtuple('Fix', ['lat', 'lon', 'utc', 'quality', 'satellites', 'received'])
+
+
+#========================================================================================
+class GPSReader:
+    '''Background NMEA reader that keeps the latest GGA/RMC fix.
+
+        INPUTS:
+           ser - serial object the GPS is connected to (serial.Serial or udas_serial.SerialConnection)
+           track_length - number of fixes kept in memory for the track (full rate)
+           track_log - optional udas_logger.UDASLogWriter every fix is written to
+           max_age - read() reports 'nan' once the newest fix is older than this many seconds
+
+        A raw serial.Serial that fails is closed and reopened by the reader thread once a second (a
+        udas_serial.SerialConnection reconnects on its own).
+
+        EXAMPLE:
+           gps_reader = GPSReader(ser)
+           gps_reader.start()
+           fix = gps_reader.latest_fix()   #never blocks, None until the first fix
+           lat,lon = gps_reader.read()     #same return values as get_gps
+        '''
+    def __init__(self, ser, track_length=3600, track_log=None, max_age=5.0):
+        self.ser = ser
+        self.track = collections.deque(maxlen=track_length)
+        self.track_log = track_log
+        self.max_age = max_age
+        self.fix = None
+        self.quality = 0
+        self.satellites = 0
+        self.date = None
+        self.sentences = 0
+        self.parse_errors = 0
+        self.read_errors = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='GPS', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(2)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                line = self.ser.readline()
+            except (serial.SerialException, OSError) as e:
+                self.read_errors = self.read_errors + 1
+                print('GPS read error: {}'.format(e))
+                self.reopen()
+                continue
+            if not line:
+                continue
+            self.add_line(line, time.monotonic())
+
+    def reopen(self):
+        #wait a second and try to open the port again; the next readline tells if it worked
+        try:
+            self.ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        if self.stop_event.wait(1):
+            return
+        try:
+            self.ser.open()
+        except (serial.SerialException, OSError):
+            pass
+
+    #------------------------------------------------------------------
+    def add_line(self, line, received):
+        '''Parse one NMEA sentence and update the latest fix if it is a GGA or RMC with a position.
+            Sentences that do not parse (bad checksum, missing or garbled fields) are counted in parse_errors.'''
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        try:
+            fix = self.parse_fix(line, received)
+        except (pynmea2.ParseError, ValueError, TypeError, AttributeError):
+            self.parse_errors = self.parse_errors + 1
+            return None
+        if fix is None:
+            return None
+        with self.lock:
+            self.fix = fix
+            self.track.append(fix)
+        if self.track_log is not None:
+            self.track_log.writerow([str(fix.utc), fix.lat, fix.lon, fix.quality, fix.satellites])
+        return fix
+
+    def parse_fix(self, line, received):
+        #Fix of a GGA or RMC sentence, None for other sentences and sentences without a position
+        msg = pynmea2.parse(line.strip())
+        self.sentences = self.sentences + 1
+        if msg.sentence_type == 'GGA':
+            self.quality = int(msg.gps_qual or 0)
+            self.satellites = int(msg.num_sats or 0)
+            if self.quality == 0:
+                return None
+        elif msg.sentence_type == 'RMC':
+            #a garbled date is left as a string by pynmea2; keep the last good one instead
+            if isinstance(msg.datestamp, date):
+                self.date = msg.datestamp
+            if msg.status != 'A':
+                return None
+        else:
+            return None
+        if not msg.lat or not msg.lon:
+            return None
+        utc = None
+        if msg.timestamp is not None:
+            #GGA has no date: use the last RMC date, or the Pi's clock until an RMC arrives
+            day = self.date if self.date is not None else datetime.now(timezone.utc).date()
+            utc = datetime.combine(day, msg.timestamp).replace(tzinfo=timezone.utc)
+        return Fix(msg.latitude, msg.longitude, utc, self.quality, self.satellites, received)
+
+    #------------------------------------------------------------------
+    def latest_fix(self):
+        '''Most recent fix (a Fix namedtuple) or None. Never blocks.'''
+        with self.lock:
+            return self.fix
+
+    def fix_age(self):
+        '''Seconds since the latest fix was received, None before the first fix.'''
+        fix = self.latest_fix()
+        if fix is None:
+            return None
+        return time.monotonic() - fix.received
+
+    def read(self):
+        '''Latitude and longitude of the latest fix in decimal degrees, ('nan','nan') if there is none
+            newer than max_age. Drop-in for get_gps in the acquisition loop.'''
+        fix = self.latest_fix()
+        if fix is None or time.monotonic() - fix.received > self.max_age:
+            return 'nan','nan'
+        return fix.lat, fix.lon
+
+    def get_track(self):
+        '''Copy of the fixes held in memory, oldest first.'''
+        with self.lock:
+            return list(self.track)
+
+
+#========================================================================================
+def nmea_command(body):
+    '''Full NMEA sentence for a command body, e.g. nmea_command('PMTK220,1000') -> '$PMTK220,1000*1F\\r\\n'.'''
+    checksum = 0
+    for char in body:
+        checksum ^= ord(char)
+    return '${}*{:02X}\r\n'.format(body, checksum)
+
+
+def gps_sensor(name, conf, ports):
+    '''udas_registry driver for an NMEA GPS read in the background by GPSReader.
+
+        CONFIGURATION:
+           commands - PMTK command bodies sent at start (e.g. to turn on GGA and RMC and set the update rate)
+           track_prefix - file prefix of the full rate track log, none if left out
+           max_age - seconds before an old fix is reported as 'nan'
+        '''
+    conn = open_port(name, conf, ports)
+    track_log = None
+    if conf.get('track_prefix'):
+        track_log = udas_logger.UDASLogWriter(conf['track_prefix'], ['Time (UTC)','Latitude','Longitude','Fix quality','Satellites'],
+                                              flush_rows=60, flush_interval=30, rotate_hourly=True)
+    reader = GPSReader(conn, track_length=conf.get('track_length', 3600), track_log=track_log, max_age=conf.get('max_age', 5.0))
+
+    def start():
+        for command in conf.get('commands', []):
+            conn.write(nmea_command(command))
+        reader.start()
+
+    def stop():
+        reader.stop()
+        if track_log is not None:
+            track_log.close()
+
+    return Sensor(name, reader.read, ['lat', 'lon'], interval=1, dtype='f8', method='nearest', tolerance=1,
+                  conn=conn, counters={'parse_errors': lambda: reader.parse_errors, 'read_errors': lambda: reader.read_errors,
+                                       'fix_age_s': reader.fix_age},
+                  start=start, stop=stop)
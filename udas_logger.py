@@ -0,0 +1,144 @@
+##UDAS Log Writer
+#Keeps the CSV log open and writes rows in batches instead of open/append/close for every sample.
+#This cuts the number of writes to the Raspberry Pi SD card and the wear that comes with them.
+
+import os
+import csv
+import time
+from datetime import datetime
+
+
+#========================================================================================
+class UDASLogWriter:
+    '''Buffered CSV writer with a flush/fsync policy and file rotation.
+
+        INPUTS:
+           prefix - start of the file name, the start time and '.csv' are added (e.g. 'UDAS/UDAS_')
+           header - list of column names written at the top of every file
+           flush_rows - write the buffered rows to the file once this many are waiting
+           flush_interval - or once the oldest buffered row is this many seconds old
+           fsync - 'flush'  : fsync the file after every flush (at most one flush window is lost on power loss)
+                   'rotate' : only fsync when a file is closed
+                   'never'  : leave it to the operating system
+           rotate_bytes - start a new file once the current one is bigger than this (None = no size limit)
+           rotate_hourly - start a new file at the top of every hour
+
+        EXAMPLE:
+           log = UDASLogWriter('UDAS/UDAS_', ['Time (UTC)','TempC'], flush_rows=30, flush_interval=10)
+           log.writerow([str(datetime.utcnow()), Temp])
+           ...
+           log.close()
+        '''
+    def __init__(self, prefix, header, flush_rows=60, flush_interval=10.0, fsync='flush',
+                 rotate_bytes=None, rotate_hourly=False):
+        if fsync not in ('flush', 'rotate', 'never'):
+            raise ValueError("fsync must be 'flush', 'rotate' or 'never'")
+        self.prefix = prefix
+        self.header = list(header)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        self.rotate_hourly = rotate_hourly
+        self.buffer = []
+        self.first_buffered = None
+        self.f = None
+        self.file_name = None
+        self.file_hour = None
+        self.files = []
+        self.open_new_file()
+
+    #------------------------------------------------------------------
+    def open_new_file(self):
+        '''Close the current file (if any) and start a new one with the header row.'''
+        self.close_file()
+        file_time = datetime.now()
+        self.file_name = self.prefix + str(file_time) + '.csv'
+        self.file_hour = file_time.replace(minute=0, second=0, microsecond=0)
+        self.f = open(self.file_name, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(self.header)
+        self.f.flush()
+        if self.fsync != 'never':
+            os.fsync(self.f.fileno())
+            sync_directory(self.file_name)
+        self.files.append(self.file_name)
+        return self.file_name
+
+    def close_file(self):
+        if self.f is None:
+            return
+        self.f.flush()
+        if self.fsync != 'never':
+            os.fsync(self.f.fileno())
+        self.f.close()
+        self.f = None
+
+    def needs_rotation(self):
+        if self.rotate_hourly and datetime.now().replace(minute=0, second=0, microsecond=0) != self.file_hour:
+            return True
+        if self.rotate_bytes is not None and self.f.tell() >= self.rotate_bytes:
+            return True
+        return False
+
+    #------------------------------------------------------------------
+    def writerow(self, row):
+        '''Add one row to the buffer and flush it if the count or time limit has been reached.'''
+        if not self.buffer:
+            self.first_buffered = time.monotonic()
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_rows or self.flush_due():
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush_due(self):
+        '''True when buffered rows are older than flush_interval.'''
+        return bool(self.buffer) and time.monotonic() - self.first_buffered >= self.flush_interval
+
+    def poll(self):
+        '''Flush if the time limit has passed. Call this from loops that may go a while without new rows.'''
+        if self.flush_due():
+            self.flush()
+
+    def flush(self):
+        '''Write all buffered rows to disk according to the fsync policy, then rotate if needed.'''
+        if self.buffer:
+            self.writer.writerows(self.buffer)
+            self.buffer = []
+            self.f.flush()
+            if self.fsync == 'flush':
+                os.fsync(self.f.fileno())
+        if self.needs_rotation():
+            self.open_new_file()
+
+    def close(self):
+        '''Flush anything left in the buffer and close the file.'''
+        if self.buffer:
+            self.writer.writerows(self.buffer)
+            self.buffer = []
+        self.close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#========================================================================================
+def sync_directory(file_name):
+    '''fsync the directory holding file_name so a newly created file survives a power cut.'''
+    directory = os.path.dirname(os.path.abspath(file_name))
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
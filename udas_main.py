@@ -0,0 +1,202 @@
+##UDAS Main
+#Single entry point for the UDAS. The sensors, their ports, baud rates, parsers and rates, and the log, publish
+#and metrics settings all come from a JSON configuration file (udas_config.json), so one process can run any
+#subset of the instruments without editing code. Sensor drivers are looked up by name in udas_registry.py and
+#only the ones used are loaded.
+#
+#Run from the terminal:
+#   python udas_main.py                          #every enabled sensor in udas_config.json
+#   python udas_main.py --sensors TSG,gps        #just the TSG and GPS
+#   python udas_main.py my_cruise.json --drivers #list the drivers that can be used in a configuration
+
+import json
+import queue
+import argparse
+from datetime import datetime
+
+import udas_workers
+import udas_serial
+import udas_logger
+import udas_fusion
+import udas_columns
+import udas_ringbuffer
+import udas_publish
+import udas_metrics
+import udas_registry
+import udas_qc
+import udas_decimate
+
+
+#========================================================================================
+def load_config(file_name):
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def address(value):
+    #JSON has no tuples: ["host", port] -> ('host', port), a string stays a Unix socket path
+    if value is None or isinstance(value, str):
+        return value
+    return tuple(value)
+
+
+#========================================================================================
+class Pipeline:
+    '''Sensors, time grid, logs, live publisher and metrics of one UDAS run, built from a configuration.
+
+        EXAMPLE:
+           pipeline = Pipeline(load_config('udas_config.json'), only=['TSG','gps'])
+           pipeline.run()
+        '''
+    def __init__(self, config, only=None):
+        self.config = config
+        log_conf = config.get('log', {})
+        self.interval = log_conf.get('interval', 1)
+        self.ports = udas_serial.SerialManager()
+        self.sensors = udas_registry.build_sensors(config, self.ports, only)
+        if not self.sensors:
+            raise ValueError('No sensors enabled in the configuration')
+
+        #sensors with a "qc" entry get a QC flag column after each of their values (see udas_qc.py)
+        self.qc_sensors = set(sensor.name for sensor in self.sensors if sensor.qc)
+        columns = [('time', 'f8', 'Time (UTC)')]
+        for sensor in self.sensors:
+            for f, h in zip(sensor.fields, sensor.headers):
+                columns.append((f, sensor.dtype, h))
+                if sensor.name in self.qc_sensors:
+                    columns.append((f + '_qc', 'u1', h + ' QC'))
+        headers = ['Time (UTC)', 'Time (PST)'] + [h for f, dtype, h in columns[1:]]
+        self.fields = [f for f, dtype, h in columns]
+        self.log_format = log_conf.get('format', 'csv')
+        self.log = None
+        self.column_log = None
+        if self.log_format == 'columns':
+            #typed binary column files with epoch time (see udas_columns.py)
+            self.column_log = udas_columns.UDASColumnWriter(log_conf.get('prefix', 'UDAS/UDAS_') + str(datetime.now()), columns)
+        else:
+            self.log = udas_logger.UDASLogWriter(log_conf.get('prefix', 'UDAS/UDAS_'), headers,
+                                                 flush_rows=log_conf.get('flush_rows', 30),
+                                                 flush_interval=log_conf.get('flush_interval', 10),
+                                                 fsync=log_conf.get('fsync', 'flush'),
+                                                 rotate_bytes=log_conf.get('rotate_bytes'),
+                                                 rotate_hourly=log_conf.get('rotate_hourly', True))
+
+        self.fusion = udas_fusion.SensorFusion(interval=self.interval, max_lag=log_conf.get('max_lag', 5))
+        self.store = udas_ringbuffer.RingStore()
+        for sensor in self.sensors:
+            self.fusion.add_sensor(sensor.name, method=sensor.method, tolerance=sensor.tolerance, missing=sensor.missing)
+            self.store.add_sensor(sensor.name, sensor.fields, capacity=config.get('ring_capacity', 86400))
+        self.qc = udas_qc.QCStage([self.fusion, self.store])
+        for sensor in self.sensors:
+            if sensor.name in self.qc_sensors:
+                self.qc.add_sensor(sensor.name, sensor.fields, sensor.qc.get('tests', {}),
+                                   window=sensor.qc.get('window', 11), despike=sensor.qc.get('despike', True))
+                self.fusion.add_sensor(sensor.name + '_qc', method='nearest', tolerance=sensor.tolerance,
+                                       missing=tuple(udas_qc.MISSING for f in sensor.fields))
+
+        #mean/min/max/std/count of every channel at coarser resolutions for quick looks (see udas_decimate.py)
+        decimate_conf = config.get('decimate', {})
+        self.decimator = None
+        if decimate_conf.get('tiers'):
+            channels = [f for sensor in self.sensors for f in sensor.fields]
+            self.decimator = udas_decimate.Decimator(channels, decimate_conf['tiers'],
+                                                     udas_decimate.open_tiers(decimate_conf.get('prefix', 'UDAS/UDAS_'),
+                                                                              channels, decimate_conf['tiers']))
+
+        publish_conf = config.get('publish', {})
+        self.publisher = None
+        if publish_conf.get('address') is not None:
+            self.publisher = udas_publish.Publisher(address(publish_conf['address']), self.fields)
+
+        metrics_conf = config.get('metrics', {})
+        self.metrics = udas_metrics.MetricsRegistry()
+        for sensor in self.sensors:
+            if sensor.conn is not None:
+                self.metrics.watch_port(sensor.name, sensor.conn)
+            for key, fcn in sensor.counters.items():
+                self.metrics.watch(sensor.name, key, fcn)
+            if sensor.name in self.qc_sensors:
+                self.metrics.watch(sensor.name, 'qc_flags', self.qc.sensors[sensor.name].summary)
+        self.metrics_server = udas_metrics.MetricsServer(self.metrics, address(metrics_conf.get('address')),
+                                                         metrics_conf.get('summary_file'), metrics_conf.get('interval', 60))
+        self.samples = queue.Queue()
+        self.workers = []
+
+    #------------------------------------------------------------------
+    def start(self):
+        for sensor in self.sensors:
+            sensor.start()
+        self.workers = udas_workers.start_workers([(sensor.name, sensor.read_fcn, sensor.args, sensor.interval, sensor.batch)
+                                                   for sensor in self.sensors], self.samples, self.metrics)
+
+    def step(self):
+        '''Take the new samples off the queue and write every finished row. Returns the rows written.'''
+        udas_workers.drain_queue(self.samples, self.qc, timeout=self.interval/2)
+        rows = []
+        for grid_time, record in self.fusion.pop_records():
+            values = [grid_time]
+            channels = []
+            for sensor in self.sensors:
+                if sensor.name in self.qc_sensors:
+                    for value, flag in zip(sensor.values(record[sensor.name]), record[sensor.name + '_qc']):
+                        values.extend((value, flag))
+                        #suspect and failed values are left out of the decimated statistics
+                        channels.append(value if flag in (udas_qc.PASS, udas_qc.NOT_EVALUATED) else 'nan')
+                else:
+                    values.extend(sensor.values(record[sensor.name]))
+                    channels.extend(sensor.values(record[sensor.name]))
+            if self.decimator is not None:
+                self.decimator.add(grid_time, channels)
+            if self.column_log is not None:
+                self.column_log.writerow(values)
+            else:
+                self.log.writerow([str(datetime.utcfromtimestamp(grid_time)), str(datetime.fromtimestamp(grid_time))] + values[1:])
+            if self.publisher is not None:
+                self.publisher.publish(values)
+            print(str(datetime.fromtimestamp(grid_time)), ' '.join(str(v) for v in values[1:]))
+            rows.append(values)
+        if self.log is not None:
+            self.log.poll()
+        if self.column_log is not None:
+            self.column_log.poll()
+        if self.decimator is not None:
+            self.decimator.poll()
+        return rows
+
+    def run(self):
+        self.start()
+        try:
+            while True:
+                self.step()
+        finally:
+            self.close()
+
+    def close(self):
+        udas_workers.stop_workers(self.workers)
+        for sensor in self.sensors:
+            sensor.stop()
+        if self.publisher is not None:
+            self.publisher.close()
+        self.metrics_server.close()
+        self.ports.close_all()
+        if self.log is not None:
+            self.log.close()
+        if self.column_log is not None:
+            self.column_log.close()
+        if self.decimator is not None:
+            self.decimator.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the UDAS from a configuration file')
+    parser.add_argument('config', nargs='?', default='udas_config.json', help='JSON configuration file')
+    parser.add_argument('--sensors', help='comma separated names of the sensors to run (default: every enabled sensor)')
+    parser.add_argument('--drivers', action='store_true', help='list the registered sensor drivers and exit')
+    args = parser.parse_args()
+
+    if args.drivers:
+        for name, target in udas_registry.DRIVERS.items():
+            print(name, target)
+    else:
+        only = args.sensors.split(',') if args.sensors else None
+        Pipeline(load_config(args.config), only).run()
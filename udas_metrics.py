@@ -0,0 +1,218 @@
+##UDAS Sensor Metrics
+#Health and latency counters for every sensor in the acquisition path, so a timeout, a parse error, a dead
+#port and a slow instrument can be told apart mid-cruise instead of all showing up as 'nan'.
+#Metrics are served as JSON on a local HTTP endpoint and written to a summary file every few seconds.
+#
+#   curl http://127.0.0.1:8000/metrics
+
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+# Upper edges of the latency histogram buckets in milliseconds (the last bucket catches everything slower)
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, float('inf')]
+
+
+#========================================================================================
+class SensorMetrics:
+    '''Counters and a read latency histogram for one sensor.
+
+        reads      - calls of the sensor read function
+        samples    - good samples those reads returned
+        empty      - reads that returned nothing usable
+        errors     - reads that raised an exception
+        latency    - histogram of read times (LATENCY_BUCKETS_MS)
+        last_sample - time.time() of the newest sample, used for the sample age
+        '''
+    def __init__(self, name):
+        self.name = name
+        self.reads = 0
+        self.samples = 0
+        self.empty = 0
+        self.errors = 0
+        self.latency = np.zeros(len(LATENCY_BUCKETS_MS), dtype=np.int64)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.last_sample = None
+        self.lock = threading.Lock()
+
+    def record_read(self, seconds, samples, timestamp=None, error=False):
+        '''Record one read that took seconds and returned samples good values.'''
+        ms = seconds * 1000.0
+        with self.lock:
+            self.reads = self.reads + 1
+            self.latency[np.searchsorted(LATENCY_BUCKETS_MS, ms)] += 1
+            self.latency_sum = self.latency_sum + ms
+            self.latency_max = max(self.latency_max, ms)
+            if error:
+                self.errors = self.errors + 1
+            elif samples == 0:
+                self.empty = self.empty + 1
+            else:
+                self.samples = self.samples + samples
+                self.last_sample = timestamp if timestamp is not None else time.time()
+
+    def latency_percentile(self, q):
+        '''Upper bucket edge (ms) below which q percent of the reads finished. In the last (overflow) bucket
+            this is the slowest read seen, so the value is always a finite number that can be written as JSON.'''
+        total = self.latency.sum()
+        if total == 0:
+            return None
+        i = min(int(np.searchsorted(np.cumsum(self.latency), total * q / 100.0)), len(LATENCY_BUCKETS_MS) - 1)
+        if i == len(LATENCY_BUCKETS_MS) - 1:
+            return self.latency_max
+        return LATENCY_BUCKETS_MS[i]
+
+    def snapshot(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return {'reads': self.reads,
+                    'samples': self.samples,
+                    'empty_reads': self.empty,
+                    'errors': self.errors,
+                    'latency_ms': {'mean': self.latency_sum / self.reads if self.reads else None,
+                                   'p50': self.latency_percentile(50),
+                                   'p90': self.latency_percentile(90),
+                                   'p99': self.latency_percentile(99),
+                                   'max': self.latency_max,
+                                   'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS_MS], self.latency.tolist()))},
+                    'sample_age_s': None if self.last_sample is None else now - self.last_sample}
+
+
+#========================================================================================
+class MetricsRegistry:
+    '''All sensor metrics of one acquisition run.
+
+        INPUTS:
+           parse_errors - dictionary {sensor: malformed line count} kept by the parsers
+                          (UDAS_FCNS_Module.malformed_lines)
+
+        Serial ports registered with watch_port() add their timeouts, reconnects, bytes read and
+        whether they are currently open to the sensor's snapshot. Any other counter can be added with
+        watch(), e.g. watch('SUNA', 'parse_errors', lambda: suna_stream.bad_lines).
+
+        bytes_per_s is the rate since the previous snapshot of the same window, so each reader of the metrics
+        (the HTTP endpoint, the summary file) gets its own rate however often the others poll.
+        '''
+    def __init__(self, parse_errors=None):
+        self.sensors = {}
+        self.ports = {}
+        self.extra = {}
+        self.parse_errors = parse_errors if parse_errors is not None else {}
+        self.start = time.time()
+        self.windows = {}   #window: (time of its last snapshot, {sensor: bytes read then})
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.sensors:
+                self.sensors[name] = SensorMetrics(name)
+            return self.sensors[name]
+
+    def watch_port(self, name, conn):
+        '''Include the counters of a udas_serial.SerialConnection in the metrics of sensor name.'''
+        self.get(name)
+        self.ports[name] = conn
+
+    def watch(self, name, key, fcn):
+        '''Report fcn() as key in the metrics of sensor name.'''
+        self.get(name)
+        self.extra.setdefault(name, {})[key] = fcn
+
+    def snapshot(self, window='default'):
+        '''All metrics as a dictionary that can be written as JSON. window names the caller's rate window.'''
+        now = time.time()
+        with self.lock:
+            sensors = dict(self.sensors)
+            last_time, last_bytes = self.windows.get(window, (self.start, {}))
+            new_bytes = {}
+            self.windows[window] = (now, new_bytes)
+        elapsed = max(now - last_time, 1e-9)
+        result = {'time': now, 'uptime_s': now - self.start, 'sensors': {}}
+        for name, metrics in sensors.items():
+            snap = metrics.snapshot(now)
+            snap['parse_errors'] = self.parse_errors.get(name, 0)
+            conn = self.ports.get(name)
+            if conn is not None:
+                snap['port'] = conn.port
+                snap['port_open'] = conn.is_open
+                snap['timeouts'] = conn.timeouts
+                snap['reconnects'] = conn.reconnects
+                snap['bytes'] = conn.bytes_read
+                snap['bytes_per_s'] = (conn.bytes_read - last_bytes.get(name, 0)) / elapsed
+                new_bytes[name] = conn.bytes_read
+            for key, fcn in self.extra.get(name, {}).items():
+                snap[key] = fcn()
+            result['sensors'][name] = snap
+        return result
+
+    def write_summary(self, file_name, window='summary'):
+        '''Write a snapshot to file_name. The file is replaced in one step so readers never see half a file.'''
+        tmp = file_name + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(window), f, indent=1)
+        os.replace(tmp, file_name)
+
+
+#========================================================================================
+class MetricsServer:
+    '''Serve the registry as JSON on http://host:port/metrics and write it to a summary file every interval seconds.
+
+        INPUTS:
+           registry - MetricsRegistry
+           address - ('host', port) of the HTTP endpoint, None for no endpoint
+           summary_file - file the snapshot is written to, None for no file
+           interval - seconds between summary files
+        '''
+    def __init__(self, registry, address=('127.0.0.1', 8000), summary_file=None, interval=60.0):
+        self.registry = registry
+        self.summary_file = summary_file
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.httpd = None
+        if address is not None:
+            self.httpd = ThreadingHTTPServer(address, make_handler(registry))
+            self.httpd.daemon_threads = True
+            threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True).start()
+        self.thread = None
+        if summary_file is not None:
+            self.thread = threading.Thread(target=self.run, name='metrics-summary', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.registry.write_summary(self.summary_file)
+            except OSError as e:
+                print('Could not write metrics summary: {}'.format(e))
+
+    def close(self):
+        self.stop_event.set()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        if self.summary_file is not None:
+            self.registry.write_summary(self.summary_file)
+
+
+def make_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = json.dumps(registry.snapshot('http'), indent=1).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return MetricsHandler
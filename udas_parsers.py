@@ -0,0 +1,129 @@
+##UDAS Line Parsers
+#Declarative description of each instrument's ASCII output line and a batch parser that turns many raw lines
+#(bytes, straight from the serial port) into NumPy arrays in one call. Lines that do not parse are counted
+#instead of being hidden by a bare except.
+
+import collections
+import operator
+import numpy as np
+
+
+# How to read one instrument line:
+#   name      - instrument label
+#   delimiter - bytes between fields, None for any whitespace
+#   fields    - list of (column name, field index) pairs
+#   prefix    - only lines starting with this are data lines (others, e.g. SUNA dark frames, are skipped)
+LineSpec = collections.namedtuple('LineSpec', ['name', 'delimiter', 'fields', 'prefix'])
+
+TSG_SPEC = LineSpec('TSG', b',', [('temp', 0), ('conductivity', 1), ('salinity', 2)], None)
+SUNA_SPEC = LineSpec('SUNA', b',', [('nitrate', 3), ('nitrogen', 4)], b'SATSL')
+SUNA_DARK_SPEC = LineSpec('SUNA_dark', b',', [('nitrate', 3), ('nitrogen', 4)], b'SATSD')
+TM_SPEC = LineSpec('TM', None, [('beam_attenuation', 4)], None)
+CHLA_SPEC = LineSpec('chla', None, [('chl_a', 3), ('turbidity', 4)], None)
+
+SPECS = {'TSG': TSG_SPEC, 'SUNA': SUNA_SPEC, 'TM': TM_SPEC, 'chla': CHLA_SPEC}
+
+# Result of a batch parse:
+#   values    - structured array with one float64 column per field, one row per good line
+#   rows      - index of each good line in the input (to match lines with their arrival times)
+#   malformed - lines that matched the prefix but had too few fields or a field that is not a number
+#   skipped   - blank lines and lines without the prefix
+ParseResult = collections.namedtuple('ParseResult', ['values', 'rows', 'malformed', 'skipped'])
+
+
+#========================================================================================
+def spec_dtype(spec):
+    return np.dtype([(name, 'f8') for name, index in spec.fields])
+
+
+def parse_lines(spec, lines):
+    '''Parse a list of raw lines from one instrument.
+
+        The data lines are parsed together by np.loadtxt (C speed). Only when that fails are they parsed again one
+        at a time, to find and count the malformed ones.
+
+        INPUTS:
+           spec - LineSpec of the instrument (e.g. TSG_SPEC)
+           lines - list of bytes (str lines are accepted too)
+
+        RETURNS:
+        ParseResult (see above)
+        '''
+    stripped = [(line.encode() if isinstance(line, str) else line).strip() for line in lines]
+    if spec.prefix is None:
+        keep = [i for i, line in enumerate(stripped) if line]
+    else:
+        keep = [i for i, line in enumerate(stripped) if line.startswith(spec.prefix)]
+    skipped = len(stripped) - len(keep)
+    dtype = spec_dtype(spec)
+    if not keep:
+        return ParseResult(np.empty(0, dtype=dtype), np.empty(0, dtype=np.intp), 0, skipped)
+    try:
+        values = np.loadtxt([stripped[i].decode(errors='replace') for i in keep], dtype=float, comments=None, ndmin=2,
+                            delimiter=spec.delimiter.decode() if spec.delimiter is not None else None,
+                            usecols=[index for name, index in spec.fields])
+        rows = keep
+        malformed = 0
+    except ValueError:
+        values, rows = parse_each(spec, stripped, keep)
+        malformed = len(keep) - len(rows)
+    values = np.ascontiguousarray(values, dtype=float).view(dtype).reshape(-1)
+    return ParseResult(values, np.array(rows, dtype=np.intp), malformed, skipped)
+
+
+def parse_each(spec, lines, keep):
+    #one line at a time: (n, fields) array of the good lines and their indexes, malformed lines left out
+    getter = operator.itemgetter(*[index for name, index in spec.fields])
+    n_fields = max(index for name, index in spec.fields) + 1
+    single = len(spec.fields) == 1
+    good = []
+    rows = []
+    for i in keep:
+        parts = lines[i].split(spec.delimiter)
+        if len(parts) < n_fields:
+            continue
+        try:
+            if single:
+                good.append((float(getter(parts)),))
+            else:
+                good.append(tuple(map(float, getter(parts))))
+        except ValueError:
+            continue
+        rows.append(i)
+    return np.array(good, dtype=float).reshape(len(good), len(spec.fields)), rows
+
+
+def split_lines(data, remainder=b''):
+    '''Split a chunk of bytes read from a port into complete lines.
+
+        INPUTS:
+           data - bytes just read
+           remainder - incomplete line left over from the previous chunk
+
+        RETURNS:
+        list of complete lines (without line endings), new remainder
+        '''
+    data = remainder + data
+    end = data.rfind(b'\n')
+    if end < 0:
+        return [], data
+    lines = data[:end].split(b'\n')
+    return [line.rstrip(b'\r') for line in lines], data[end + 1:]
+
+
+def parse_buffer(spec, data, remainder=b''):
+    '''Parse every complete line in a chunk of bytes; the trailing partial line is returned for the next call.
+
+        RETURNS:
+        ParseResult, new remainder
+        '''
+    lines, remainder = split_lines(data, remainder)
+    return parse_lines(spec, lines), remainder
+
+
+def parse_line(spec, line):
+    '''Parse a single line. Returns a tuple of floats or None if the line is not a good data line.'''
+    result = parse_lines(spec, [line])
+    if len(result.values) == 0:
+        return None
+    return tuple(float(v) for v in result.values[0])
@@ -0,0 +1,185 @@
+##UDAS Live Publisher
+#Streams every merged UDAS record to any number of subscribers over a local TCP or Unix socket, so deck
+#displays or a second laptop can watch the survey live without tailing the CSV.
+#
+#Frames: 4 byte big-endian length followed by the payload.
+#   The first frame sent to a new subscriber is JSON: {"fields": [...], "format": "<11d"}
+#   Every frame after that is one record packed with that struct format (NaN for missing values).
+#A subscriber that falls more than max_pending bytes behind is disconnected so it can never stall acquisition.
+#
+#Watch from the terminal:  python udas_publish.py 127.0.0.1:5555
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import select
+import threading
+
+from udas_columns import UDAS_COLUMNS, to_float
+
+
+LENGTH = struct.Struct('>I')
+
+
+#========================================================================================
+class Publisher:
+    '''Publish server for UDAS records.
+
+        INPUTS:
+           address - ('host', port) for TCP or a file path for a Unix socket
+           fields - names of the values in each record, the UDAS_COLUMNS names by default
+           max_pending - bytes a subscriber may fall behind before it is dropped
+
+        EXAMPLE:
+           publisher = Publisher(('0.0.0.0', 5555))
+           publisher.publish([grid_time, lat, lon, Temp, Conductivity, Salinity, nitrate_uM, nitrogen, chl_a, turb, Beam_Attenuation])
+           publisher.close()
+        '''
+    def __init__(self, address=('127.0.0.1', 5555), fields=None, max_pending=65536):
+        if fields is None:
+            fields = [name for name, dtype, header in UDAS_COLUMNS]
+        self.fields = list(fields)
+        self.record = struct.Struct('<{}d'.format(len(self.fields)))
+        self.hello = frame(json.dumps({'fields': self.fields, 'format': self.record.format}).encode())
+        self.max_pending = max_pending
+        self.address = address
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(8)
+        self.server.setblocking(False)
+        self.clients = {}          #socket: bytearray of data not sent yet
+        self.published = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='publisher', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        '''Accept new subscribers and finish sending to the ones that are behind.'''
+        while not self.stop_event.is_set():
+            with self.lock:
+                waiting = [sock for sock, pending in self.clients.items() if pending]
+            try:
+                readable, writable, _ = select.select([self.server], waiting, [], 0.2)
+            except (OSError, ValueError):
+                continue
+            if readable:
+                try:
+                    sock, addr = self.server.accept()
+                except OSError:
+                    sock = None
+                if sock is not None:
+                    sock.setblocking(False)
+                    with self.lock:
+                        self.clients[sock] = bytearray(self.hello)
+                        self.send(sock)
+            with self.lock:
+                for sock in writable:
+                    if sock in self.clients:
+                        self.send(sock)
+
+    def send(self, sock):
+        #send as much as the socket takes without blocking (call with the lock held)
+        pending = self.clients[sock]
+        try:
+            sent = sock.send(pending)
+            del pending[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.drop(sock)
+
+    def drop(self, sock):
+        self.clients.pop(sock, None)
+        self.dropped = self.dropped + 1
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    #------------------------------------------------------------------
+    def publish(self, values):
+        '''Send one record (in the order of fields) to every subscriber. Never blocks.'''
+        data = frame(self.record.pack(*[to_float(v) for v in values]))
+        with self.lock:
+            for sock in list(self.clients):
+                pending = self.clients[sock]
+                if len(pending) + len(data) > self.max_pending:
+                    #too slow, drop it rather than hold up acquisition
+                    self.drop(sock)
+                    continue
+                pending.extend(data)
+                self.send(sock)
+        self.published = self.published + 1
+
+    def subscribers(self):
+        with self.lock:
+            return len(self.clients)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(1)
+        with self.lock:
+            for sock in list(self.clients):
+                sock.close()
+            self.clients = {}
+        self.server.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+#========================================================================================
+def frame(payload):
+    return LENGTH.pack(len(payload)) + payload
+
+
+def recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError('publisher closed the connection')
+        data = data + chunk
+    return data
+
+
+def recv_frame(sock):
+    length, = LENGTH.unpack(recv_exact(sock, LENGTH.size))
+    return recv_exact(sock, length)
+
+
+def subscribe(address=('127.0.0.1', 5555)):
+    '''Connect to a Publisher and yield each record as a dictionary {field: value}.'''
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    try:
+        hello = json.loads(recv_frame(sock).decode())
+        fields = hello['fields']
+        record = struct.Struct(hello['format'])
+        while True:
+            yield dict(zip(fields, record.unpack(recv_frame(sock))))
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1:5555'
+    if ':' in target:
+        host, port = target.rsplit(':', 1)
+        target = (host, int(port))
+    for rec in subscribe(target):
+        print(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(rec.get('time', 0))),
+              ' '.join('{}={:.4f}'.format(k, v) for k, v in rec.items() if k != 'time'))
@@ -0,0 +1,178 @@
+##UDAS Real-Time QC
+#Incremental quality control of each sensor value as it is acquired, so spikes, stuck values and out of range
+#readings are flagged in the log instead of being found later. Each sensor keeps a fixed size window of its last
+#values (constant memory) and all the values of one sample are checked together with NumPy.
+#
+#Flags follow the QARTOD convention:
+#   1 pass, 2 not evaluated, 3 suspect, 4 fail, 9 missing
+#
+#Tests (any can be left out for a value):
+#   range  - [min, max] of physically possible values, outside is a fail
+#   rate   - largest change per second from the previous good value, faster is suspect
+#   spike  - largest distance from the rolling median of the window, further is suspect (and despiked)
+#   stuck  - [n, tolerance]: the last n values all within tolerance of each other is suspect (flat line)
+
+import math
+import numpy as np
+
+
+PASS = 1
+NOT_EVALUATED = 2
+SUSPECT = 3
+FAIL = 4
+MISSING = 9
+
+
+def as_array(values, n):
+    #sample values (numbers, 'nan' or 'NA' strings) as a float array
+    if not isinstance(values, (tuple, list)):
+        values = (values,)
+    out = np.full(n, np.nan)
+    for i, v in enumerate(values[:n]):
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+#========================================================================================
+class SensorQC:
+    '''QC tests for the values of one sensor.
+
+        INPUTS:
+           fields - names of the sensor's values, in order
+           tests - {field: {'range': [min, max], 'rate': max per second, 'spike': max distance from median,
+                            'stuck': [n, tolerance]}}; fields without tests are flagged 2 (not evaluated)
+           window - number of recent values kept for the rolling median
+           despike - replace values that fail the spike test with the rolling median
+
+        EXAMPLE:
+           qc = SensorQC(['temp','conductivity','salinity'], {'temp': {'range': [-2, 40], 'spike': 1.0}})
+           values, flags = qc.check(time.time(), (12.1, 4.2, 33.5))
+        '''
+    def __init__(self, fields, tests, window=11, despike=True):
+        self.fields = list(fields)
+        n = len(self.fields)
+        self.despike = despike
+        self.evaluated = np.zeros(n, dtype=bool)
+        self.low = np.full(n, -np.inf)
+        self.high = np.full(n, np.inf)
+        self.rate = np.full(n, np.inf)
+        self.spike = np.full(n, np.inf)
+        self.stuck_n = np.zeros(n, dtype=int)
+        self.stuck_tol = np.zeros(n)
+        for i, field in enumerate(self.fields):
+            test = tests.get(field)
+            if not test:
+                continue
+            self.evaluated[i] = True
+            if 'range' in test:
+                self.low[i], self.high[i] = test['range']
+            if 'rate' in test:
+                self.rate[i] = test['rate']
+            if 'spike' in test:
+                self.spike[i] = test['spike']
+            if 'stuck' in test:
+                self.stuck_n[i], self.stuck_tol[i] = test['stuck']
+        #the window must hold enough values for the longest stuck test
+        self.window = max(window, int(self.stuck_n.max()) if n else 0)
+        self.history = np.full((self.window, n), np.nan)   #ring of recent in range values
+        self.head = 0
+        self.last_value = np.full(n, np.nan)
+        self.last_time = np.full(n, np.nan)
+        self.counts = dict((flag, np.zeros(n, dtype=np.int64)) for flag in (PASS, NOT_EVALUATED, SUSPECT, FAIL, MISSING))
+
+    def check(self, timestamp, values):
+        '''QC one sample.
+
+            RETURNS:
+            values (despiked, same form as given: a tuple, or a float for one value sensors), flags (tuple of ints)
+            '''
+        x = as_array(values, len(self.fields))
+        missing = np.isnan(x)
+        flags = np.where(self.evaluated, PASS, NOT_EVALUATED)
+
+        fail = (x < self.low) | (x > self.high)
+        dt = timestamp - self.last_time
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fast = np.abs(x - self.last_value) > self.rate * np.where(dt > 0, dt, np.nan)
+            enough = np.count_nonzero(~np.isnan(self.history), axis=0) >= 3
+            median = np.nanmedian(np.where(enough, self.history, 0.0), axis=0)
+            median = np.where(enough, median, np.nan)
+            spike = np.abs(x - median) > self.spike
+        stuck = self.is_stuck(x)
+
+        suspect = (fast | spike | stuck) & self.evaluated
+        flags = np.where(suspect, SUSPECT, flags)
+        flags = np.where(fail & self.evaluated, FAIL, flags)
+        flags = np.where(missing, MISSING, flags)
+
+        #only in range values go into the window so one bad reading does not shift the median
+        keep = ~missing & ~fail
+        self.history[self.head] = np.where(keep, x, np.nan)
+        self.head = (self.head + 1) % self.window
+        good = keep & ~spike
+        self.last_value = np.where(good, x, self.last_value)
+        self.last_time = np.where(good, timestamp, self.last_time)
+
+        if self.despike:
+            x = np.where(spike & self.evaluated & ~fail, median, x)
+        for flag in self.counts:
+            self.counts[flag] += flags == flag
+
+        out = tuple(v if not math.isnan(v) else 'nan' for v in x.tolist())
+        if not isinstance(values, (tuple, list)):
+            out = out[0]
+        return out, tuple(flags.tolist())
+
+    def is_stuck(self, x):
+        #the current value and the n - 1 before it all within tolerance
+        stuck = np.zeros(len(self.fields), dtype=bool)
+        for i in np.flatnonzero(self.stuck_n > 1):
+            n = self.stuck_n[i]
+            recent = self.history[(self.head - np.arange(1, n)) % self.window, i]
+            if np.isnan(recent).any() or np.isnan(x[i]):
+                continue
+            stuck[i] = max(recent.max(), x[i]) - min(recent.min(), x[i]) <= self.stuck_tol[i]
+        return stuck
+
+    def summary(self):
+        '''Number of values given each flag, per field.'''
+        return dict((field, dict((str(flag), int(count[i])) for flag, count in self.counts.items()))
+                    for i, field in enumerate(self.fields))
+
+
+#========================================================================================
+class QCStage:
+    '''QC step between the acquisition workers and the rest of the pipeline.
+
+        Has the same add(name, timestamp, values) method as udas_fusion.SensorFusion, so it is fed with
+        udas_workers.drain_queue. Each sample is checked and passed on to the sinks with its (despiked) values,
+        and the flags are passed on as a separate sensor called name + '_qc'.
+
+        EXAMPLE:
+           qc = QCStage([fusion, store])
+           qc.add_sensor('TSG', ['temp','conductivity','salinity'], {'salinity': {'range': [0, 42], 'spike': 0.5}})
+           udas_workers.drain_queue(samples, qc)
+        '''
+    def __init__(self, sinks):
+        self.sinks = sinks if isinstance(sinks, (list, tuple)) else [sinks]
+        self.sensors = {}
+
+    def add_sensor(self, name, fields, tests, window=11, despike=True):
+        self.sensors[name] = SensorQC(fields, tests, window, despike)
+        return self.sensors[name]
+
+    def add(self, name, timestamp, values):
+        qc = self.sensors.get(name)
+        flags = None
+        if qc is not None:
+            values, flags = qc.check(timestamp, values)
+        for sink in self.sinks:
+            sink.add(name, timestamp, values)
+            if flags is not None:
+                sink.add(name + '_qc', timestamp, flags)
+
+    def summary(self):
+        return dict((name, qc.summary()) for name, qc in self.sensors.items())
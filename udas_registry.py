@@ -0,0 +1,135 @@
+##UDAS Sensor Registry
+#Sensor drivers registered by name. A driver is only imported when a sensor in the configuration uses it,
+#so a run without the GPS never imports pynmea2 and a run without the SUNA never loads its driver.
+#
+#A driver is a function driver(name, conf, ports) that opens what the sensor needs (conf is the sensor's entry
+#in the configuration file, ports a udas_serial.SerialManager) and returns a Sensor.
+
+import importlib
+import collections
+
+
+# driver name: 'module:function'
+DRIVERS = collections.OrderedDict([
+    ('lines', 'udas_drivers:line_sensor'),           #ASCII line instruments described by a udas_parsers LineSpec
+    ('suna_poll', 'udas_drivers:suna_poll_sensor'),  #SUNA woken up and polled with getSUNA
+    ('suna_stream', 'udas_suna:stream_sensor'),      #SUNA in continuous mode with a rolling mean
+    ('gps', 'udas_gps:gps_sensor'),                  #NMEA GPS read in the background
+])
+loaded = {}
+
+
+def register_driver(name, target):
+    '''Add a driver. target is a 'module:function' string (imported when first used) or the function itself.'''
+    DRIVERS[name] = target
+    loaded.pop(name, None)
+
+
+def load_driver(name):
+    '''Import and return the driver function registered as name.'''
+    if name not in loaded:
+        if name not in DRIVERS:
+            raise KeyError('Unknown sensor driver {!r}, known drivers: {}'.format(name, ', '.join(DRIVERS)))
+        target = DRIVERS[name]
+        if isinstance(target, str):
+            module, function = target.split(':')
+            target = getattr(importlib.import_module(module), function)
+        loaded[name] = target
+    return loaded[name]
+
+
+#========================================================================================
+class Sensor:
+    '''What the acquisition pipeline needs to know about one running sensor.
+
+        INPUTS:
+           name - label of the sensor (e.g. 'TSG')
+           read_fcn, args, interval, batch - how the worker reads it (see udas_workers.SensorWorker)
+           fields - names of the values read_fcn returns, in order
+           headers - CSV column header of each field
+           dtype - NumPy type of the values in the column files
+           method, tolerance, missing - how the values are lined up on the time grid (see udas_fusion.SensorStream)
+           conn - udas_serial.SerialConnection of the sensor, for the metrics
+           counters - {name: function} of extra health counters reported in the metrics
+           start, stop - called when the pipeline starts and stops (e.g. a background reader)
+           qc - QC settings {'tests': {field: tests}, 'window': n, 'despike': bool} (see udas_qc.SensorQC), None for no QC
+        '''
+    def __init__(self, name, read_fcn, fields, headers=None, args=(), interval=0, batch=False, dtype='f4',
+                 method='linear', tolerance=2.0, missing=None, conn=None, counters=None, start=None, stop=None, qc=None):
+        self.name = name
+        self.read_fcn = read_fcn
+        self.args = tuple(args)
+        self.interval = interval
+        self.batch = batch
+        self.fields = list(fields)
+        self.headers = list(headers) if headers is not None else list(self.fields)
+        self.dtype = dtype
+        self.method = method
+        self.tolerance = tolerance
+        if missing is None:
+            missing = 'nan' if len(self.fields) == 1 else tuple('nan' for field in self.fields)
+        self.missing = missing
+        self.conn = conn
+        self.counters = counters if counters is not None else {}
+        self.start_fcn = start
+        self.stop_fcn = stop
+        self.qc = qc
+
+    def configure(self, conf):
+        '''Apply the settings in a configuration entry that are common to every driver.'''
+        self.interval = conf.get('interval', self.interval)
+        self.fields = conf.get('fields', self.fields)
+        self.headers = conf.get('headers', self.headers)
+        self.dtype = conf.get('dtype', self.dtype)
+        self.method = conf.get('method', self.method)
+        self.tolerance = conf.get('tolerance', self.tolerance)
+        self.qc = conf.get('qc', self.qc)
+        return self
+
+    def start(self):
+        if self.start_fcn is not None:
+            self.start_fcn()
+
+    def stop(self):
+        if self.stop_fcn is not None:
+            self.stop_fcn()
+
+    def values(self, sample):
+        '''Sample values as a list in the order of fields.'''
+        if len(self.fields) == 1 and not isinstance(sample, (tuple, list)):
+            return [sample]
+        return list(sample)
+
+
+#========================================================================================
+def build_sensors(config, ports, only=None):
+    '''Create a Sensor for every enabled entry in config['sensors'].
+
+        INPUTS:
+           config - configuration dictionary (see udas_config.json)
+           ports - udas_serial.SerialManager the drivers open their ports in
+           only - names of the sensors to run, None for every sensor that is not "enabled": false
+
+        RETURNS:
+        list of Sensor in the order of the configuration file (this is also the column order of the log)
+        '''
+    sensors = []
+    for conf in config['sensors']:
+        name = conf['name']
+        if only is not None:
+            if name not in only:
+                continue
+        elif not conf.get('enabled', True):
+            continue
+        driver = load_driver(conf['driver'])
+        sensors.append(driver(name, conf, ports).configure(conf))
+    if only is not None:
+        unknown = set(only) - set(sensor.name for sensor in sensors)
+        if unknown:
+            raise KeyError('No sensor called {} in the configuration'.format(', '.join(sorted(unknown))))
+    return sensors
+
+
+def open_port(name, conf, ports):
+    '''Open the serial port described by a sensor's configuration entry.'''
+    return ports.add(name, conf['port'], conf['baudrate'], timeout=conf.get('timeout', 1), **conf.get('options', {}))
@@ -0,0 +1,144 @@
+##UDAS Ring Buffer Store
+#Keeps the most recent samples of every sensor in memory in fixed size, preallocated NumPy arrays so live
+#displays, QC and on-board summaries can ask for "the last 5 minutes of salinity" without reading the CSV.
+
+import threading
+import time
+import numpy as np
+
+from udas_columns import to_float
+
+
+#========================================================================================
+class RingBuffer:
+    '''Fixed capacity, time ordered buffer of samples stored in a NumPy structured array.
+
+        INPUTS:
+           fields - names of the values stored with each sample (e.g. ['temp','conductivity','salinity'])
+           capacity - number of samples kept; the oldest sample is overwritten when the buffer is full
+           dtype - NumPy type of the values
+
+        Every sample also has a 'time' field (epoch seconds). Samples are expected to arrive in time order.
+        Appends are O(1); queries return copies in time order.
+        '''
+    def __init__(self, fields, capacity=86400, dtype='f8'):
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.data = np.full(capacity, np.nan, dtype=[('time', 'f8')] + [(name, dtype) for name in self.fields])
+        self.head = 0        #index the next sample is written to
+        self.count = 0       #number of valid samples
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, values):
+        '''Add one sample. values is a tuple in the order of fields (or a single value for one field).'''
+        if not isinstance(values, (tuple, list)):
+            values = (values,)
+        row = (timestamp,) + tuple(to_float(v) for v in values)
+        with self.lock:
+            self.data[self.head] = row
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, times, values):
+        '''Add many samples at once.
+
+            INPUTS:
+               times - array of epoch times
+               values - structured array with the same field names, or a 2D array with one column per field
+            '''
+        times = np.asarray(times, dtype='f8')
+        n = times.size
+        if n == 0:
+            return
+        block = np.empty(n, dtype=self.data.dtype)
+        block['time'] = times
+        for i, name in enumerate(self.fields):
+            block[name] = values[name] if values.dtype.names else values[:, i]
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            n = self.capacity
+        with self.lock:
+            end = self.head + n
+            if end <= self.capacity:
+                self.data[self.head:end] = block
+            else:
+                first = self.capacity - self.head
+                self.data[self.head:] = block[:first]
+                self.data[:n - first] = block[first:]
+            self.head = end % self.capacity
+            self.count = min(self.count + n, self.capacity)
+
+    #------------------------------------------------------------------
+    def last(self, n):
+        '''The n most recent samples, oldest first.'''
+        with self.lock:
+            n = min(n, self.count)
+            if n == 0:
+                return self.data[:0].copy()
+            start = (self.head - n) % self.capacity
+            if start < self.head:
+                return self.data[start:self.head].copy()
+            return np.concatenate((self.data[start:], self.data[:self.head]))
+
+    def window(self, start, end=None):
+        '''Samples with start <= time < end (end=None for everything up to now), oldest first.'''
+        with self.lock:
+            if self.count < self.capacity:
+                segments = [(0, self.count)]
+            else:
+                #the buffer has wrapped: the oldest samples are after head, the newest before it
+                segments = [(self.head, self.capacity), (0, self.head)]
+            parts = []
+            for a, b in segments:
+                times = self.data['time'][a:b]
+                i = np.searchsorted(times, start, side='left')
+                j = times.size if end is None else np.searchsorted(times, end, side='left')
+                parts.append(self.data[a + i:a + j])
+            return np.concatenate(parts)
+
+    def since(self, seconds, now=None):
+        '''Samples from the last seconds (e.g. since(300) for the last 5 minutes).'''
+        if now is None:
+            now = time.time()
+        return self.window(now - seconds)
+
+    def latest(self):
+        '''Most recent sample as a one element structured array, or None.'''
+        last = self.last(1)
+        return last[0] if len(last) else None
+
+
+#========================================================================================
+class RingStore:
+    '''One RingBuffer per sensor.
+
+        Has the same add(name, timestamp, values) method as udas_fusion.SensorFusion, so it can be fed
+        straight from the acquisition workers with udas_workers.drain_queue.
+
+        EXAMPLE:
+           store = RingStore()
+           store.add_sensor('TSG', ['temp','conductivity','salinity'], capacity=86400)
+           store.add('TSG', time.time(), (12.1, 4.2, 33.5))
+           salinity = store['TSG'].since(300)['salinity']
+        '''
+    def __init__(self):
+        self.buffers = {}
+
+    def add_sensor(self, name, fields, capacity=86400, dtype='f8'):
+        self.buffers[name] = RingBuffer(fields, capacity, dtype)
+        return self.buffers[name]
+
+    def add(self, name, timestamp, values):
+        '''Add one sample. Samples from sensors without a buffer are ignored.'''
+        buffer = self.buffers.get(name)
+        if buffer is not None:
+            buffer.append(timestamp, values)
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def __contains__(self, name):
+        return name in self.buffers
@@ -0,0 +1,136 @@
+##UDAS Sampling Scheduler
+#Runs sensor reads on absolute deadlines of the monotonic clock (start, start + interval, start + 2*interval, ...)
+#instead of sleeping a fixed time after the work, so the sample spacing does not drift with how long a read took.
+#A read that runs past its next deadline is an overrun: the deadlines it covered are skipped (not run late in
+#a burst) and the schedule carries on from the next slot on the same grid.
+#Every schedule keeps the jitter (how late each run started) and the overrun count.
+
+import collections
+import threading
+import time
+import numpy as np
+
+
+#========================================================================================
+class PeriodicSchedule:
+    '''Deadlines every interval seconds on the monotonic clock.
+
+        INPUTS:
+           interval - seconds between deadlines
+           start - monotonic time of the first deadline (default: now)
+
+        EXAMPLE:
+           schedule = PeriodicSchedule(1.0)
+           while schedule.wait():
+               read_sensor()
+               schedule.finished()
+        '''
+    def __init__(self, interval, start=None, history=1000):
+        self.interval = float(interval)
+        self.deadline = time.monotonic() if start is None else start
+        self.runs = 0
+        self.overruns = 0          #runs that finished after the following deadline
+        self.skipped = 0           #deadlines dropped because of overruns
+        self.jitter = collections.deque(maxlen=history)   #seconds each run started after its deadline
+
+    def wait(self, stop_event=None):
+        '''Sleep until the next deadline. Returns False if stop_event was set while waiting.
+            Call finished() when the work for this deadline is done.'''
+        delay = self.deadline - time.monotonic()
+        if delay > 0:
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+        self.started()
+        return stop_event is None or not stop_event.is_set()
+
+    def due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now >= self.deadline
+
+    def started(self, now=None):
+        '''Record that the run for the current deadline started and move on to the next deadline.'''
+        if now is None:
+            now = time.monotonic()
+        late = now - self.deadline
+        self.jitter.append(late)
+        self.runs = self.runs + 1
+        self.deadline = self.deadline + self.interval
+
+    def finished(self, now=None):
+        '''Record the end of a run. A run that ends after the next deadline is an overrun and the
+            deadlines it covered are skipped.'''
+        if now is None:
+            now = time.monotonic()
+        if now > self.deadline:
+            missed = int((now - self.deadline) // self.interval) + 1
+            self.overruns = self.overruns + 1
+            self.skipped = self.skipped + missed
+            self.deadline = self.deadline + missed * self.interval
+
+    def report(self):
+        '''Jitter in milliseconds and overrun counts as a dictionary.'''
+        ms = np.asarray(self.jitter) * 1000.0
+        return {'interval_s': self.interval,
+                'runs': self.runs,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'jitter_ms': {'mean': float(ms.mean()) if ms.size else None,
+                              'p50': float(np.percentile(ms, 50)) if ms.size else None,
+                              'p99': float(np.percentile(ms, 99)) if ms.size else None,
+                              'max': float(ms.max()) if ms.size else None}}
+
+
+#========================================================================================
+class Scheduler:
+    '''Runs several tasks, each at its own rate, in one thread.
+
+        EXAMPLE:
+           scheduler = Scheduler()
+           scheduler.add('TSG', read_tsg, interval=1)
+           scheduler.add('SUNA', read_suna, interval=30)
+           scheduler.run()
+
+        Tasks due at the same time run in the order they were added. A slow task delays the others
+        (this is a single thread) but never moves their deadlines; see udas_workers.py for one thread per sensor.
+        '''
+    def __init__(self):
+        self.tasks = collections.OrderedDict()   #name: (fcn, args, PeriodicSchedule)
+        self.stop_event = threading.Event()
+
+    def add(self, name, fcn, args=(), interval=1.0, start=None):
+        self.tasks[name] = (fcn, tuple(args), PeriodicSchedule(interval, start))
+
+    def run_pending(self):
+        '''Run every task whose deadline has passed. Returns the number of tasks run.'''
+        count = 0
+        for name, (fcn, args, schedule) in self.tasks.items():
+            if schedule.due():
+                schedule.started()
+                try:
+                    fcn(*args)
+                except Exception as e:
+                    print(name + ' task error: {}'.format(e))
+                schedule.finished()
+                count = count + 1
+        return count
+
+    def next_deadline(self):
+        return min(schedule.deadline for fcn, args, schedule in self.tasks.values())
+
+    def run(self):
+        '''Run the tasks until stop() is called.'''
+        while not self.stop_event.is_set():
+            self.run_pending()
+            delay = self.next_deadline() - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def report(self):
+        return dict((name, schedule.report()) for name, (fcn, args, schedule) in self.tasks.items())
@@ -0,0 +1,234 @@
+##UDAS Serial Connections
+#Opens each sensor port once and keeps it open for the whole deployment.
+#If a USB device drops out the port is closed and reopened with an increasing wait (backoff)
+#so the sensor functions in UDAS_FCNS_Module keep getting 'nan' instead of crashing the loop.
+
+import time
+import threading
+import serial
+import udas_parsers
+
+
+#========================================================================================
+# Long-lived serial port that reconnects itself
+class SerialConnection:
+    '''Persistent serial port handle that can be passed to the UDAS sensor functions in place of a serial.Serial object.
+
+        INPUTS:
+           port - device name (e.g. '/dev/ttyUSB2')
+           baudrate - baud rate of the instrument
+           timeout - read timeout in seconds
+           min_backoff - seconds to wait before the first reconnect attempt
+           max_backoff - longest wait between reconnect attempts
+           **kwargs - any other serial.Serial option (e.g. rtscts=1)
+
+        readline(), read(), write() and in_waiting behave like serial.Serial. When the device is
+        unplugged they return empty data (like a read timeout) and the port is reopened on a later
+        call once the backoff has passed.
+        '''
+    def __init__(self, port, baudrate, timeout=1, min_backoff=1.0, max_backoff=60.0, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.next_attempt = 0.0
+        self.reconnects = 0
+        self.was_open = False    #a reconnect is only counted once the port has been open before
+        self.timeouts = 0        #reads on an open port that returned nothing
+        self.bytes_read = 0
+        self.serial = None
+        self.remainder = b''
+        self.lock = threading.RLock()
+
+    #------------------------------------------------------------------
+    def connect(self):
+        '''Open the port if it is not already open. Returns True when the port is usable.'''
+        with self.lock:
+            if self.serial is not None and self.serial.is_open:
+                return True
+            now = time.monotonic()
+            if now < self.next_attempt:
+                return False
+            try:
+                self.serial = serial.Serial(self.port, self.baudrate, timeout=self.timeout, **self.kwargs)
+            except (serial.SerialException, OSError) as e:
+                print('Could not open {}: {}'.format(self.port, e))
+                self.serial = None
+                self.next_attempt = now + self.backoff
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                return False
+            if self.was_open:
+                self.reconnects = self.reconnects + 1
+            self.was_open = True
+            self.backoff = self.min_backoff
+            return True
+
+    def drop(self, error=None):
+        '''Close a port that has failed and schedule the next reconnect attempt.'''
+        with self.lock:
+            if error is not None:
+                print('Lost {}: {}'.format(self.port, error))
+            try:
+                if self.serial is not None:
+                    self.serial.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.serial = None
+            self.next_attempt = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    def _wait_for_port(self):
+        #Port is down: behave like a read timeout so callers do not spin
+        wait = min(self.timeout or 0, max(0, self.next_attempt - time.monotonic()))
+        if wait > 0:
+            time.sleep(wait)
+
+    def _count(self, data):
+        #keep the counters read by udas_metrics
+        if data:
+            self.bytes_read = self.bytes_read + len(data)
+        else:
+            self.timeouts = self.timeouts + 1
+        return data
+
+    #------------------------------------------------------------------
+    def readline(self):
+        if not self.connect():
+            self._wait_for_port()
+            return b''
+        try:
+            line = self.serial.readline()
+        except (serial.SerialException, OSError) as e:
+            self.drop(e)
+            return b''
+        return self._count(line)
+
+    def read(self, size=1):
+        if not self.connect():
+            self._wait_for_port()
+            return b''
+        try:
+            data = self.serial.read(size)
+        except (serial.SerialException, OSError) as e:
+            self.drop(e)
+            return b''
+        return self._count(data)
+
+    @property
+    def in_waiting(self):
+        if not self.connect():
+            return 0
+        try:
+            return self.serial.in_waiting
+        except (serial.SerialException, OSError) as e:
+            self.drop(e)
+            return 0
+
+    def read_available(self, block=True):
+        '''Read everything waiting in the port buffer in one call. With block=True and nothing waiting,
+            wait up to timeout for the first byte.'''
+        if not self.connect():
+            self._wait_for_port()
+            return b''
+        try:
+            n = self.serial.in_waiting
+            if n == 0:
+                if not block:
+                    return b''
+                data = self.serial.read(1)
+                if data:
+                    data = data + self.serial.read(self.serial.in_waiting)
+            else:
+                data = self.serial.read(n)
+        except (serial.SerialException, OSError) as e:
+            self.drop(e)
+            return b''
+        return self._count(data)
+
+    def read_lines(self, block=True):
+        '''Read everything waiting on the port and split it into complete lines.
+
+            A line that is only partly received is kept and finished by the next call, so no line is lost or
+            split in two. All lines are stamped with the time they were read (time.time()).
+            With block=True the call waits (up to timeout) until at least one complete line is in.
+
+            RETURNS:
+            list of lines (bytes, without line endings), arrival time
+            '''
+        deadline = time.monotonic() + (self.timeout or 0)
+        while True:
+            data = self.read_available(block)
+            arrival = time.time()
+            if not self.is_open:
+                #a dropped port loses its partial line
+                self.remainder = b''
+            lines, self.remainder = udas_parsers.split_lines(data, self.remainder)
+            if lines or not block or not data or time.monotonic() >= deadline:
+                return lines, arrival
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if not self.connect():
+            return 0
+        try:
+            return self.serial.write(data)
+        except (serial.SerialException, OSError) as e:
+            self.drop(e)
+            return 0
+
+    def reset_input_buffer(self):
+        if self.connect():
+            try:
+                self.serial.reset_input_buffer()
+            except (serial.SerialException, OSError) as e:
+                self.drop(e)
+
+    def close(self):
+        '''Close the port. The next read or write opens it again.'''
+        with self.lock:
+            if self.serial is not None:
+                self.serial.close()
+            self.serial = None
+            self.remainder = b''
+
+
+#========================================================================================
+# Keeps one SerialConnection per sensor
+class SerialManager:
+    '''Holds the persistent connections for all the sensors on the UDAS.
+
+        EXAMPLE:
+           ports = SerialManager()
+           ports.add('TSG', '/dev/ttyUSB2', 38400, timeout=5)
+           Temp,Conductivity,Salinity = udas.getTSG(ports['TSG'])
+        '''
+    def __init__(self):
+        self.connections = {}
+
+    def add(self, name, port, baudrate, timeout=1, **kwargs):
+        '''Register a sensor port and try to open it. Returns the SerialConnection.'''
+        conn = SerialConnection(port, baudrate, timeout=timeout, **kwargs)
+        conn.connect()
+        self.connections[name] = conn
+        return conn
+
+    def get(self, name):
+        return self.connections[name]
+
+    def __getitem__(self, name):
+        return self.connections[name]
+
+    def __contains__(self, name):
+        return name in self.connections
+
+    def close_all(self):
+        for conn in self.connections.values():
+            conn.close()
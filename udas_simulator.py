@@ -0,0 +1,299 @@
+##UDAS Sensor Simulator
+#Creates pseudo-terminals (virtual serial ports) that behave like the UDAS instruments so the acquisition code
+#can be run on a laptop without the Raspberry Pi and sensors. Rates can be sped up (e.g. 10-100x real time)
+#and jitter, dropped lines and garbage bytes added to find where the acquisition code runs out of throughput.
+#
+#Run from the terminal:  python udas_simulator.py --speedup 10
+#then set the 'port' of each sensor in udas_config.json (or a copy of it) to the /dev/pts/N device it prints
+#and run:  python udas_main.py <config>
+
+import os
+import pty
+import tty
+import time
+import math
+import errno
+import random
+import select
+import threading
+import argparse
+from datetime import datetime, timezone
+
+
+#========================================================================================
+# Line generators for each instrument. Each takes a random.Random and the simulation time in seconds.
+def tsg_line(rng, t):
+    '''SBE45 TSG: temperature, conductivity, salinity'''
+    temp = 12.5 + 0.5 * math.sin(t / 600) + rng.gauss(0, 0.002)
+    cond = 4.10 + 0.02 * math.sin(t / 600) + rng.gauss(0, 0.0002)
+    sal = 33.5 + 0.05 * math.sin(t / 900) + rng.gauss(0, 0.001)
+    return ' {:8.4f}, {:8.5f}, {:8.4f}\r\n'.format(temp, cond, sal)
+
+
+def transmissometer_line(rng, t):
+    '''C-Star transmissometer: serial number, reference, signal, raw counts, beam attenuation (column 4)'''
+    c = 0.45 + 0.1 * math.sin(t / 300) + rng.gauss(0, 0.005)
+    return 'CST-1719PR\t{:05d}\t{:05d}\t{:05d}\t{:.3f}\r\n'.format(15835, 12000 + rng.randint(-50, 50), 11800 + rng.randint(-50, 50), c)
+
+
+def fluorometer_line(rng, t):
+    '''ECO fluorometer: date, time, wavelength, chlorophyll counts (column 3), turbidity counts (column 4), thermistor'''
+    now = datetime.now()
+    chl = int(60 + 20 * math.sin(t / 400) + rng.gauss(0, 2))
+    turb = int(120 + 10 * math.sin(t / 500) + rng.gauss(0, 3))
+    return '{}\t{}\t695\t{}\t{}\t538\r\n'.format(now.strftime('%m/%d/%y'), now.strftime('%H:%M:%S'), chl, turb)
+
+
+def suna_frame(rng, t, light=True):
+    '''SUNA full ASCII frame: header, date, time, nitrate (uM, column 3), nitrogen (mg/L, column 4), ...'''
+    now = datetime.now()
+    if light:
+        nitrate = max(0.0, 15 + 3 * math.sin(t / 1200) + rng.gauss(0, 0.3))
+        header = 'SATSLF1234'
+    else:
+        nitrate = 0.0
+        header = 'SATSDF1234'
+    nitrogen = nitrate * 0.014007
+    return '{},{},{:.5f},{:.2f},{:.4f},0.0000,0.000\r\n'.format(header, now.strftime('%Y%j'), now.hour + now.minute / 60.0, nitrate, nitrogen)
+
+
+def nmea_checksum(body):
+    checksum = 0
+    for char in body:
+        checksum ^= ord(char)
+    return '{:02X}'.format(checksum)
+
+
+def nmea_position(value, hemispheres, width):
+    hemi = hemispheres[0] if value >= 0 else hemispheres[1]
+    value = abs(value)
+    degrees = int(value)
+    minutes = (value - degrees) * 60
+    return '{:0{}d}{:07.4f}'.format(degrees, width, minutes), hemi
+
+
+def gps_lines(rng, t, start=(36.8107, -121.7845)):
+    '''GGA and RMC sentences for a boat drifting slowly north east of Moss Landing'''
+    lat = start[0] + t * 2e-6
+    lon = start[1] + t * 2e-6
+    now = datetime.now(timezone.utc)
+    stamp = now.strftime('%H%M%S') + '.{:02d}'.format(now.microsecond // 10000)
+    lat_s, ns = nmea_position(lat, 'NS', 2)
+    lon_s, ew = nmea_position(lon, 'EW', 3)
+    gga = 'GPGGA,{},{},{},{},{},1,08,0.9,2.0,M,-32.1,M,,'.format(stamp, lat_s, ns, lon_s, ew)
+    rmc = 'GPRMC,{},A,{},{},{},{},0.8,45.0,{},,,A'.format(stamp, lat_s, ns, lon_s, ew, now.strftime('%d%m%y'))
+    return '${}*{}\r\n${}*{}\r\n'.format(gga, nmea_checksum(gga), rmc, nmea_checksum(rmc))
+
+
+def recorded_lines(file_name):
+    '''Line generator that replays a recorded raw serial log (one instrument line per line), looping at the end.'''
+    with open(file_name, newline='') as f:
+        lines = [line if line.endswith('\n') else line + '\r\n' for line in f if line.strip()]
+    state = {'i': 0}
+
+    def next_line(rng, t):
+        line = lines[state['i'] % len(lines)]
+        state['i'] = state['i'] + 1
+        return line
+    return next_line
+
+
+#========================================================================================
+class SimulatedInstrument(threading.Thread):
+    '''One virtual serial port streaming lines from a generator.
+
+        INPUTS:
+           name - label of the instrument
+           line_fcn - function(rng, t) returning the next output line(s) as str
+           rate - lines per second at real time (0 = only answers commands)
+           speedup - multiplies the rate and the simulation clock (10 = ten times real time)
+           jitter - standard deviation of the interval between lines as a fraction of the interval
+           dropout - probability that a line is not sent
+           garbage - probability that random bytes are sent before a line
+           seed - random seed so runs can be repeated
+
+        The device to open is in self.port (e.g. '/dev/pts/5'). Output that the reader does not take off
+        the port is dropped once the pseudo-terminal buffer is full, like a UART overrun.
+        '''
+    def __init__(self, name, line_fcn, rate=1.0, speedup=1.0, jitter=0.0, dropout=0.0, garbage=0.0, seed=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.instrument = name
+        self.line_fcn = line_fcn
+        self.rate = rate
+        self.speedup = speedup
+        self.jitter = jitter
+        self.dropout = dropout
+        self.garbage = garbage
+        self.rng = random.Random(seed)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.stop_event = threading.Event()
+        self.lines_sent = 0
+        self.lines_dropped = 0
+        self.overruns = 0
+        self.input = b''
+        self.start_time = time.monotonic()
+
+    def sim_time(self):
+        return (time.monotonic() - self.start_time) * self.speedup
+
+    def send(self, text):
+        '''Write to the port, adding garbage bytes and dropping lines as configured.'''
+        if self.dropout and self.rng.random() < self.dropout:
+            self.lines_dropped = self.lines_dropped + 1
+            return
+        data = text.encode()
+        if self.garbage and self.rng.random() < self.garbage:
+            data = bytes(self.rng.randrange(256) for i in range(self.rng.randint(1, 16))) + data
+        try:
+            os.write(self.master, data)
+            self.lines_sent = self.lines_sent + 1
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EIO):
+                raise
+            self.overruns = self.overruns + 1
+
+    def next_interval(self):
+        interval = 1.0 / (self.rate * self.speedup)
+        if self.jitter:
+            interval = max(0.0, self.rng.gauss(interval, self.jitter * interval))
+        return interval
+
+    def handle_command(self, command):
+        '''Called with every line written to the port. Instruments that take commands override this.'''
+        pass
+
+    def read_commands(self, timeout):
+        ready, _, _ = select.select([self.master], [], [], max(0.0, timeout))
+        if not ready:
+            return
+        try:
+            self.input = self.input + os.read(self.master, 1024)
+        except OSError:
+            return
+        while b'\n' in self.input or b'\r' in self.input:
+            cut = min(i for i in (self.input.find(b'\n'), self.input.find(b'\r')) if i >= 0)
+            command = self.input[:cut].decode(errors='replace').strip()
+            self.input = self.input[cut + 1:]
+            if command:
+                self.handle_command(command)
+
+    def streaming(self):
+        return self.rate > 0
+
+    def run(self):
+        next_line = time.monotonic()
+        while not self.stop_event.is_set():
+            if self.streaming():
+                now = time.monotonic()
+                if now >= next_line:
+                    self.send(self.line_fcn(self.rng, self.sim_time()))
+                    next_line = max(next_line + self.next_interval(), now - 1.0)
+                self.read_commands(next_line - time.monotonic())
+            else:
+                self.read_commands(0.1)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(1)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+#========================================================================================
+class SimulatedSUNA(SimulatedInstrument):
+    '''Virtual SUNA. Answers the wake up text with a prompt, sends N light frames (after one dark frame)
+        for 'measure N', and streams frames at rate while in continuous mode ('set OperMode Continuous'
+        then 'exit'; '$' stops it).'''
+    def __init__(self, rate=1.0, frame_time=1.0, **kwargs):
+        SimulatedInstrument.__init__(self, 'SUNA', suna_frame, rate=rate, **kwargs)
+        self.frame_time = frame_time
+        self.continuous = False
+        self.continuous_pending = False
+
+    def streaming(self):
+        return self.continuous
+
+    def handle_command(self, command):
+        words = command.split()
+        if words[0].lower() == 'measure':
+            try:
+                n = int(words[1])
+            except (IndexError, ValueError):
+                n = 1
+            self.send(suna_frame(self.rng, self.sim_time(), light=False))
+            for i in range(n):
+                time.sleep(self.frame_time / self.speedup)
+                self.send(suna_frame(self.rng, self.sim_time()))
+        elif command.lower().startswith('set opermode continuous'):
+            self.continuous_pending = True
+            self.send('$Ok\r\n')
+        elif command.lower() == 'exit':
+            if self.continuous_pending:
+                self.continuous = True
+                self.continuous_pending = False
+        elif command.startswith('$'):
+            self.continuous = False
+            self.send('SUNA>\r\n')
+        else:
+            self.send('SUNA V2 simulator\r\nSUNA>\r\n')
+
+
+#========================================================================================
+DEFAULT_RATES = {'TSG': 1.0, 'TM': 1.0, 'chla': 1.0, 'gps': 1.0, 'SUNA': 1.0}
+
+
+def start_simulators(speedup=1.0, jitter=0.0, dropout=0.0, garbage=0.0, seed=None, rates=None, recordings=None):
+    '''Start a virtual port for each UDAS instrument.
+
+        INPUTS:
+           speedup, jitter, dropout, garbage, seed - see SimulatedInstrument
+           rates - lines per second at real time for each instrument (SUNA: frames per second), DEFAULT_RATES if None
+           recordings - optional {name: file} of recorded raw lines to replay instead of generated ones
+                        (TSG, TM, chla and gps only; the SUNA answers commands)
+
+        RETURNS:
+        dictionary {name: SimulatedInstrument}; the device to open is sims[name].port
+        '''
+    if rates is None:
+        rates = DEFAULT_RATES
+    generators = {'TSG': tsg_line, 'TM': transmissometer_line, 'chla': fluorometer_line, 'gps': gps_lines}
+    for name, file_name in (recordings or {}).items():
+        generators[name] = recorded_lines(file_name)
+    sims = {}
+    for i, (name, line_fcn) in enumerate(generators.items()):
+        sims[name] = SimulatedInstrument(name, line_fcn, rates[name], speedup, jitter, dropout, garbage,
+                                         None if seed is None else seed + i)
+    sims['SUNA'] = SimulatedSUNA(rate=rates['SUNA'], frame_time=1.0 / rates['SUNA'], speedup=speedup, jitter=jitter,
+                                 dropout=dropout, garbage=garbage, seed=None if seed is None else seed + len(generators))
+    for sim in sims.values():
+        sim.start()
+    return sims
+
+
+def stop_simulators(sims):
+    for sim in sims.values():
+        sim.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Virtual serial ports that imitate the UDAS instruments')
+    parser.add_argument('--speedup', type=float, default=1.0, help='run this many times faster than real time')
+    parser.add_argument('--jitter', type=float, default=0.0, help='interval jitter as a fraction of the interval')
+    parser.add_argument('--dropout', type=float, default=0.0, help='probability of dropping a line')
+    parser.add_argument('--garbage', type=float, default=0.0, help='probability of garbage bytes before a line')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    sims = start_simulators(args.speedup, args.jitter, args.dropout, args.garbage, args.seed)
+    for name, sim in sims.items():
+        print('{:5s} {}'.format(name, sim.port))
+    try:
+        while True:
+            time.sleep(10)
+            print(', '.join('{} {} sent {} dropped {} overruns'.format(name, sim.lines_sent, sim.lines_dropped, sim.overruns)
+                            for name, sim in sims.items()))
+    except KeyboardInterrupt:
+        stop_simulators(sims)
@@ -0,0 +1,181 @@
+##UDAS SUNA Continuous Driver
+#Runs the SUNA in continuous (free-run) mode on a connection that stays open and averages the frames
+#as they arrive, instead of waking the SUNA and sending 'measure N' for every nitrate value (see getSUNA).
+
+import threading
+import collections
+import time
+
+from udas_registry import Sensor, open_port
+
+
+#========================================================================================
+def parse_suna_frame(line):
+    '''Split one SUNA ASCII frame into its type and nitrate values.
+
+        INPUTS:
+           line - one line from the SUNA, bytes or str
+
+        RETURNS:
+        ('light' or 'dark', nitrate_uM, nitrogen) for SATSL*/SATSD* frames, None for anything else
+        (command echoes, SATSLB binary headers, partial lines)
+        '''
+    if isinstance(line, bytes):
+        line = line.decode(errors='replace')
+    line = line.strip()
+    if not line.startswith('SATS') or len(line) < 6:
+        return None
+    if line[4] == 'L':
+        kind = 'light'
+    elif line[4] == 'D':
+        kind = 'dark'
+    else:
+        return None
+    data = line.split(',')
+    try:
+        #Check SUNA hardware manual pg 58 for column headers
+        return kind, float(data[3]), float(data[4])
+    except (IndexError, ValueError):
+        return None
+
+
+#========================================================================================
+class RollingMean:
+    '''Mean of the samples received in the last window seconds, updated in constant time per sample.'''
+    def __init__(self, window):
+        self.window = window
+        self.samples = collections.deque()
+        self.sums = [0.0, 0.0]
+
+    def add(self, t, nitrate, nitrogen):
+        self.samples.append((t, nitrate, nitrogen))
+        self.sums[0] = self.sums[0] + nitrate
+        self.sums[1] = self.sums[1] + nitrogen
+        self.expire(t)
+
+    def expire(self, now):
+        while self.samples and now - self.samples[0][0] > self.window:
+            t, nitrate, nitrogen = self.samples.popleft()
+            self.sums[0] = self.sums[0] - nitrate
+            self.sums[1] = self.sums[1] - nitrogen
+        if not self.samples:
+            #start again from exactly zero so rounding errors do not build up
+            self.sums = [0.0, 0.0]
+
+    def mean(self, now=None):
+        if now is not None:
+            self.expire(now)
+        n = len(self.samples)
+        if n == 0:
+            return None
+        return self.sums[0] / n, self.sums[1] / n
+
+
+#========================================================================================
+class SUNAStream:
+    '''Continuous-mode SUNA reader that keeps a rolling, time-windowed nitrate mean.
+
+        INPUTS:
+           suna - a serial object that stays open (e.g. udas_serial.SerialConnection)
+           window - length of the rolling mean in seconds
+           start_commands - sent once by start() to put the SUNA in continuous mode and leave the command line.
+                            Check the SUNA manual for the exact syntax of the firmware in use.
+           stop_commands - sent by stop() to bring the SUNA back to the command line
+
+        EXAMPLE:
+           suna = SUNAStream(ports['SUNA'], window=30)
+           suna.start()
+           nitrate_uM,nitrogen = suna.read()    #same return values as getSUNA, never blocks
+        '''
+    def __init__(self, suna, window=30.0, start_commands=('set OperMode Continuous', 'exit'),
+                 stop_commands=('$',)):
+        self.suna = suna
+        self.window = window
+        self.start_commands = start_commands
+        self.stop_commands = stop_commands
+        self.light = RollingMean(window)
+        self.dark = RollingMean(window)
+        self.last_frame = None
+        self.frames = 0
+        self.bad_lines = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        '''Put the SUNA in continuous mode and start reading frames in a background thread.'''
+        for command in self.start_commands:
+            self.suna.write(str.encode(command + '\r\n'))
+            time.sleep(0.5)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='SUNA', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            line = self.suna.readline()
+            if not line:
+                continue
+            self.add_line(line, time.time())
+
+    def add_line(self, line, timestamp):
+        '''Parse one line from the SUNA and add it to the light or dark mean.'''
+        frame = parse_suna_frame(line)
+        if frame is None:
+            self.bad_lines = self.bad_lines + 1
+            return
+        kind, nitrate, nitrogen = frame
+        with self.lock:
+            if kind == 'light':
+                self.light.add(timestamp, nitrate, nitrogen)
+                self.last_frame = timestamp
+            else:
+                self.dark.add(timestamp, nitrate, nitrogen)
+            self.frames = self.frames + 1
+
+    def stop(self):
+        self.stop_event.set()
+        for command in self.stop_commands:
+            self.suna.write(str.encode(command + '\r\n'))
+        if self.thread is not None:
+            self.thread.join(2)
+
+    #------------------------------------------------------------------
+    def read(self):
+        '''Rolling mean of the light frames in the last window seconds.
+
+            RETURNS
+            nitrate_uM (umol/L)
+            nitrogen (mg/L)
+            ('NA','NA') when no light frame has arrived within the window, like getSUNA
+            '''
+        with self.lock:
+            result = self.light.mean(time.time())
+        if result is None:
+            return ('NA','NA')
+        return result
+
+    def read_dark(self):
+        '''Rolling mean of the dark frames, kept apart from the light frames.'''
+        with self.lock:
+            result = self.dark.mean(time.time())
+        if result is None:
+            return ('NA','NA')
+        return result
+
+
+#========================================================================================
+def stream_sensor(name, conf, ports):
+    '''udas_registry driver for a SUNA in continuous mode.
+
+        CONFIGURATION:
+           window - seconds of light frames in the rolling mean
+           start_commands, stop_commands - see SUNAStream
+        '''
+    conn = open_port(name, conf, ports)
+    stream = SUNAStream(conn, window=conf.get('window', 30),
+                        start_commands=conf.get('start_commands', ('set OperMode Continuous', 'exit')),
+                        stop_commands=conf.get('stop_commands', ('$',)))
+    return Sensor(name, stream.read, ['nitrate', 'nitrogen'], interval=1, method='asof', missing=('NA', 'NA'),
+                  conn=conn, counters={'parse_errors': lambda: stream.bad_lines, 'frames': lambda: stream.frames},
+                  start=stream.start, stop=stream.stop)
@@ -0,0 +1,148 @@
+##UDAS Acquisition Workers
+#Runs each sensor function from UDAS_FCNS_Module in its own thread so a slow or hung
+#instrument (e.g. the SUNA wake cycle) does not hold up the other sensors.
+
+import threading
+import queue
+import time
+
+from udas_scheduler import PeriodicSchedule
+
+
+#========================================================================================
+# Worker thread that repeatedly calls one sensor function and pushes the result to a queue
+class SensorWorker(threading.Thread):
+    '''Poll a single sensor function at its own rate and feed the results into a shared queue.
+
+        INPUTS:
+           name - label for the sensor (e.g. 'TSG', 'SUNA'), stored with every sample
+           read_fcn - function that returns one reading (e.g. udas.getTSG)
+           args - arguments passed to read_fcn on every call (e.g. the serial object)
+           out_queue - queue.Queue shared by all workers
+           interval - seconds between reads, kept on fixed deadlines so the spacing does not drift (0 = as fast as the sensor answers)
+           batch - read_fcn returns a list of (timestamp, values) samples (e.g. udas.read_all) instead of one reading
+           metrics - udas_metrics.SensorMetrics that records the time of every read and how many samples it gave
+
+        Each item put on the queue is a tuple (name, timestamp, values) where timestamp is
+        time.time() taken right after read_fcn returned (or the sample's own timestamp in batch mode).
+        '''
+    def __init__(self, name, read_fcn, args=(), out_queue=None, interval=0.0, batch=False, metrics=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.sensor = name
+        self.read_fcn = read_fcn
+        self.args = tuple(args)
+        self.out_queue = out_queue
+        self.interval = interval
+        self.batch = batch
+        self.metrics = metrics
+        self.schedule = PeriodicSchedule(interval) if interval > 0 else None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.schedule is not None and not self.schedule.wait(self.stop_event):
+                break
+            start = time.monotonic()
+            error = False
+            try:
+                values = self.read_fcn(*self.args)
+            except Exception as e:
+                print(self.sensor + ' worker error: {}'.format(e))
+                values = None
+                error = True
+            read_time = time.monotonic() - start
+            timestamp = time.time()
+            if values is not None and self.batch:
+                for timestamp, sample in values:
+                    self.out_queue.put((self.sensor, timestamp, sample))
+            elif values is not None:
+                self.out_queue.put((self.sensor, timestamp, values))
+            if self.metrics is not None:
+                self.metrics.record_read(read_time, count_samples(values, self.batch), timestamp, error)
+            if self.schedule is not None:
+                self.schedule.finished()
+
+    def stop(self):
+        '''Ask the worker to exit after its current read.'''
+        self.stop_event.set()
+
+
+#========================================================================================
+def count_samples(values, batch=False):
+    '''Number of usable samples in what a sensor function returned ('nan'/'NA' placeholders do not count).'''
+    if values is None:
+        return 0
+    if batch:
+        return len(values)
+    if not isinstance(values, (tuple, list)):
+        values = (values,)
+    for v in values:
+        if str(v).strip().lower() not in ('nan', 'na', ''):
+            return 1
+    return 0
+
+
+def start_workers(sensors, out_queue, metrics=None):
+    '''Create and start one SensorWorker per sensor.
+
+        INPUTS:
+           sensors - list of (name, read_fcn, args, interval) or (name, read_fcn, args, interval, batch) tuples
+           out_queue - queue.Queue all workers write to
+           metrics - udas_metrics.MetricsRegistry to record each sensor's reads in (optional)
+
+        RETURNS:
+        list of running SensorWorker objects
+        '''
+    workers = []
+    for sensor in sensors:
+        name, read_fcn, args, interval = sensor[:4]
+        batch = len(sensor) > 4 and sensor[4]
+        worker = SensorWorker(name, read_fcn, args, out_queue, interval, batch,
+                              metrics.get(name) if metrics is not None else None)
+        if metrics is not None and worker.schedule is not None:
+            metrics.watch(name, 'schedule', worker.schedule.report)
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+def stop_workers(workers, timeout=1.0):
+    '''Signal all workers to stop and wait up to timeout seconds for each one.
+        Workers stuck in a blocking read are daemon threads and are left behind.'''
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout)
+
+
+#========================================================================================
+def drain_queue(out_queue, latest, timeout=0.1):
+    '''Move every sample waiting on the queue into the latest-value dictionary (or a fusion stage).
+
+        INPUTS:
+           out_queue - queue.Queue fed by SensorWorker threads
+           latest - dictionary {name: (timestamp, values)} updated in place, or any object with an
+                    add(name, timestamp, values) method such as udas_fusion.SensorFusion, or a list of them
+           timeout - seconds to wait for the first sample before returning
+
+        RETURNS:
+        number of samples taken off the queue
+        '''
+    count = 0
+    try:
+        item = out_queue.get(timeout=timeout)
+    except queue.Empty:
+        return count
+    sinks = latest if isinstance(latest, (list, tuple)) else [latest]
+    while True:
+        name, timestamp, values = item
+        for sink in sinks:
+            if isinstance(sink, dict):
+                sink[name] = (timestamp, values)
+            else:
+                sink.add(name, timestamp, values)
+        count = count + 1
+        try:
+            item = out_queue.get_nowait()
+        except queue.Empty:
+            return count